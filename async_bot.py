@@ -0,0 +1,416 @@
+import os
+import asyncio
+from dotenv import load_dotenv
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from async_supabase import update_course_payment_status, save_user_to_supabase, get_async_supabase_client
+from registration_outbox import registration_outbox, queue_registration, queue_course_registration
+from webinar_catalog import webinar_catalog
+from outbound_queue import outbox
+from reminder_scheduler import schedule_reminders_for_registration, schedule_all_reminders, get_webinars_by_id
+from sync_registrations_to_drive import sync_all_to_drive, sync_course_registrations_to_drive, force_full_sync, sync_report
+from media_registry import media_registry, CIRCLE_VIDEOS, COURSE_CIRCLE_VIDEO, WEBINAR_CIRCLE_VIDEO
+from metrics import timed_handler
+from conversation_state import (
+    conversations as conversation_store, SQLiteConversationStore, STEP_CONTENT_TYPES, CONVERSATION_LOCK_STRIPES,
+    is_command, step_accepts,
+)
+from bot_content import (
+    validate_phone_number, validate_email, format_phone_number,
+    WELCOME_TEXT, WEBINAR_WELCOME_TEXT, COURSE_TEXT, COURSE_HOW_TEXT, COURSE_PROGRAM_TEXT,
+    COURSE_PAYMENT_TEXT, COURSE_FAQ_TEXT, PAYMENT_INSTRUCTIONS_TEXT, RECEIPT_RECEIVED_TEXT,
+    PAYMENT_CONFIRMED_TEXT, ERROR_TEXT, TEXT_ONLY_TEXT, webinar_registration_text, course_registration_admin_text,
+    main_menu_markup, webinar_menu_markup, course_menu_markup, back_to_course_markup,
+    course_payment_markup, webinar_dates_markup, confirm_payment_markup,
+)
+
+# asyncio runtime of the bot: same conversation flow as bot.py, but handlers await
+# Telegram and Supabase I/O instead of blocking a worker thread.
+# Started from bot.py with BOT_RUNTIME=async, which also starts the shared scheduler.
+
+load_dotenv()
+TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+
+# Receipts are relayed by file_id unless RECEIPT_DOWNLOAD=1 (see bot.py)
+RECEIPT_DOWNLOAD = os.getenv('RECEIPT_DOWNLOAD', '').lower() in ('1', 'true', 'yes')
+
+bot = AsyncTeleBot(TOKEN)
+
+# Registration answers and the current step per chat live in the conversation store shared with bot.py.
+# The store's per-chat locks are threading locks, so the event loop gets its own striped asyncio locks.
+_chat_locks = [asyncio.Lock() for _ in range(CONVERSATION_LOCK_STRIPES)]
+
+def chat_lock(chat_id):
+    return _chat_locks[hash(chat_id) % len(_chat_locks)]
+
+
+class AsyncConversations:
+    """
+    Awaitable view of the conversation store. SQLite-backed stores do file I/O,
+    so their calls run in a worker thread; the in-memory store is called inline.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._offload = isinstance(store, SQLiteConversationStore)
+
+    async def _call(self, name, *args, **kwargs):
+        method = getattr(self._store, name)
+        if self._offload:
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return method(*args, **kwargs)
+
+    async def get(self, chat_id):
+        return await self._call('get', chat_id)
+
+    async def set(self, chat_id, record):
+        return await self._call('set', chat_id, record)
+
+    async def update(self, chat_id, **fields):
+        return await self._call('update', chat_id, **fields)
+
+    async def delete(self, chat_id):
+        return await self._call('delete', chat_id)
+
+
+conversations = AsyncConversations(conversation_store)
+
+async def has_pending_step(chat_id):
+    state = await conversations.get(chat_id)
+    return bool(state and state.get('step'))
+
+async def routes_to_step(message):
+    """True if the message goes to the chat's pending step. Commands (/start etc.) always reach their own handlers."""
+    return not is_command(message) and await has_pending_step(message.chat.id)
+
+# Registered first so a chat in the middle of a registration gets its next message routed to the current step
+@bot.message_handler(func=routes_to_step, content_types=STEP_CONTENT_TYPES)
+async def dispatch_step(message):
+    chat_id = message.chat.id
+    async with chat_lock(chat_id):
+        state = await conversations.get(chat_id)
+        if not state or not state.get('step'):
+            return
+        if not step_accepts(state['step'], message):
+            await bot.send_message(chat_id, TEXT_ONLY_TEXT)
+            return
+        await STEP_HANDLERS[state['step']](message, state)
+
+@bot.message_handler(commands=['upload_circle'])
+@timed_handler
+async def upload_circle_video(message):
+    """Admin command to re-upload the circle videos and refresh their cached file_ids"""
+    admin_chat_id = os.getenv('ADMIN_CHAT_ID')
+    if not admin_chat_id or str(message.chat.id) != admin_chat_id:
+        await bot.reply_to(message, "❌ Эта команда доступна только администратору.")
+        return
+
+    for path in CIRCLE_VIDEOS:
+        try:
+            file_id = await media_registry.upload_async(bot, message.chat.id, path)
+            await bot.reply_to(message, f"✅ Круговое видео {path} загружено!\n\n📋 File ID: {file_id}\n\n💡 ID сохранён автоматически, менять .env не нужно")
+        except FileNotFoundError:
+            await bot.reply_to(message, f"❌ Файл {path} не найден. Убедитесь, что файл существует в папке media/")
+        except Exception as e:
+            await bot.reply_to(message, f"❌ Ошибка при загрузке видео: {e}")
+
+@bot.message_handler(commands=['start'])
+@timed_handler
+async def send_welcome(message):
+    # /start leaves a registration in progress; the record itself stays (a course receipt may still follow)
+    if await has_pending_step(message.chat.id):
+        await conversations.update(message.chat.id, step=None)
+
+    # Save unique user to Supabase
+    try:
+        await save_user_to_supabase(message.chat.id, message.from_user.username)
+    except Exception as e:
+        print(f"Error saving user to Supabase: {e}")
+
+    await bot.send_message(message.chat.id, WELCOME_TEXT, reply_markup=main_menu_markup())
+
+async def send_circle_video(chat_id, path):
+    # Always sent by cached file_id; the bytes are only uploaded by media_registry.prewarm() at startup
+    file_id = media_registry.file_id(path)
+    if file_id:
+        try:
+            await bot.send_video_note(chat_id, file_id)
+        except ApiTelegramException as e:
+            print(f"Error sending circle video: {e}")
+            if e.error_code == 400 and 'file' in e.description.lower():
+                # Telegram rejected the file_id, upload the file again on next start
+                media_registry.forget(path)
+        except Exception as e:
+            print(f"Error sending circle video: {e}")
+            # Continue with normal flow even if video fails
+
+    # Small delay to let video load (does not hold up other chats)
+    await asyncio.sleep(1)
+
+@bot.callback_query_handler(func=lambda call: call.data == 'webinar_main')
+@timed_handler
+async def handle_webinar_main(call):
+    await send_circle_video(call.message.chat.id, WEBINAR_CIRCLE_VIDEO)
+    await bot.send_message(call.message.chat.id, WEBINAR_WELCOME_TEXT, reply_markup=webinar_menu_markup())
+
+@bot.callback_query_handler(func=lambda call: call.data == 'course_main')
+@timed_handler
+async def handle_course_main(call):
+    await send_circle_video(call.message.chat.id, COURSE_CIRCLE_VIDEO)
+    await bot.send_message(call.message.chat.id, COURSE_TEXT, reply_markup=course_menu_markup())
+
+@bot.callback_query_handler(func=lambda call: call.data == 'course_how')
+@timed_handler
+async def handle_course_how(call):
+    await bot.send_message(call.message.chat.id, COURSE_HOW_TEXT, reply_markup=back_to_course_markup())
+
+@bot.callback_query_handler(func=lambda call: call.data == 'course_program')
+@timed_handler
+async def handle_course_program(call):
+    await bot.send_message(call.message.chat.id, COURSE_PROGRAM_TEXT, reply_markup=back_to_course_markup())
+
+@bot.callback_query_handler(func=lambda call: call.data == 'course_payment')
+@timed_handler
+async def handle_course_payment(call):
+    await bot.send_message(call.message.chat.id, COURSE_PAYMENT_TEXT, reply_markup=course_payment_markup())
+
+@bot.callback_query_handler(func=lambda call: call.data == 'course_faq')
+@timed_handler
+async def handle_course_faq(call):
+    await bot.send_message(call.message.chat.id, COURSE_FAQ_TEXT, reply_markup=back_to_course_markup())
+
+@bot.callback_query_handler(func=lambda call: call.data == 'course_pay')
+@timed_handler
+async def handle_course_pay(call):
+    chat_id = call.message.chat.id
+    await conversations.set(chat_id, {'type': 'course', 'step': 'course_full_name'})
+    await bot.send_message(chat_id, "Для регистрации на курс, пожалуйста, напишите ваше полное имя:")
+
+@bot.callback_query_handler(func=lambda call: call.data == 'register')
+@timed_handler
+async def handle_register(call):
+    try:
+        # The catalog is usually a cache hit; a refresh runs in a worker thread
+        dates = await asyncio.to_thread(webinar_catalog.all)
+        if not dates:
+            await bot.send_message(call.message.chat.id, "В данный момент нет доступных вебинаров.")
+            return
+        await bot.send_message(call.message.chat.id, "Пожалуйста, выберите дату вебинара:", reply_markup=webinar_dates_markup(dates))
+    except Exception as e:
+        await bot.send_message(call.message.chat.id, f"Ошибка при получении дат вебинаров: {e}")
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('date_'))
+@timed_handler
+async def handle_date_selection(call):
+    chat_id = call.message.chat.id
+    date_id = call.data.replace('date_', '')
+    try:
+        selected = await asyncio.to_thread(webinar_catalog.get, date_id)
+        if not selected:
+            await bot.send_message(chat_id, "Выбранный вебинар не найден. Пожалуйста, попробуйте снова.")
+            return
+        await conversations.set(chat_id, {'step': 'full_name', 'date': selected['date'], 'date_id': selected['id'], 'link': selected.get('link')})
+        await bot.send_message(chat_id, "Напишите свое имя")
+    except Exception as e:
+        await bot.send_message(chat_id, f"Ошибка при обработке вашего выбора: {e}")
+
+@timed_handler
+async def process_course_full_name(message, state):
+    chat_id = message.chat.id
+    await conversations.update(chat_id, full_name=message.text, step='course_phone')
+    await bot.send_message(chat_id, "Пожалуйста, напишите свой номер телефона:")
+
+@timed_handler
+async def process_course_phone(message, state):
+    chat_id = message.chat.id
+    phone = message.text.strip()
+
+    # Validate phone number
+    if not validate_phone_number(phone):
+        await bot.send_message(chat_id, "🚫 Пожалуйста, введите корректный номер телефона (пример: +77011234567)")
+        return
+
+    state = await conversations.update(chat_id, phone=format_phone_number(phone), telegram_username=message.from_user.username)
+
+    # Queue the course registration for Supabase (an fsynced SQLite write, maybe the insert too; kept off the event loop);
+    # its id is generated locally, so the flow goes on right away
+    registration = await asyncio.to_thread(queue_course_registration, state, chat_id, message.from_user.username)
+    if not registration:
+        await bot.send_message(chat_id, ERROR_TEXT)
+        return
+
+    await conversations.update(chat_id, registration_id=registration['id'])
+
+    outbox.send_message(chat_id, "✅ Регистрация на курс прошла успешно!")
+    outbox.send_message(chat_id, PAYMENT_INSTRUCTIONS_TEXT)
+    outbox.send_message(chat_id, "📸 Отправьте фото чека об оплате:")
+    await conversations.update(chat_id, step='payment_receipt')
+
+@timed_handler
+async def process_payment_receipt(message, state):
+    chat_id = message.chat.id
+    if not message.photo:
+        await bot.send_message(chat_id, "Пожалуйста, отправьте фото чека об оплате.")
+        return
+
+    try:
+        # Relay the largest photo size by file_id; downloading the bytes is opt-in
+        photo_to_send = message.photo[-1].file_id
+        if RECEIPT_DOWNLOAD:
+            file_info = await bot.get_file(photo_to_send)
+            photo_to_send = await bot.download_file(file_info.file_path)
+
+        outbox.send_message(chat_id, RECEIPT_RECEIVED_TEXT)
+
+        # Notify admin about new course registration with photo
+        admin_chat_id = os.getenv('ADMIN_CHAT_ID')
+        if admin_chat_id:
+            registration_id = state.get('registration_id')
+            outbox.send_photo(
+                int(admin_chat_id),
+                photo_to_send,
+                caption=course_registration_admin_text(state, registration_id),
+                reply_markup=confirm_payment_markup(registration_id)
+            )
+        else:
+            print("ADMIN_CHAT_ID not set in environment variables")
+        # Receipt delivered; keep the record (without a step) so a corrected receipt photo is still relayed
+        await conversations.update(chat_id, step=None)
+    except Exception as e:
+        print(f"Error processing payment receipt: {e}")
+        await bot.send_message(chat_id, "⚠️ Ошибка при обработке чека. Пожалуйста, попробуйте снова.")
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('confirm_'))
+@timed_handler
+async def handle_payment_confirmation(call):
+    """Handle payment confirmation from admin"""
+    try:
+        registration_id = call.data.replace('confirm_', '')
+        # The registration may still be waiting in the outbox; send just that row
+        await asyncio.to_thread(registration_outbox.flush_key, registration_id)
+        # Returns the updated registration, so the user can be notified without another query
+        registration = await update_course_payment_status(registration_id)
+        if not registration:
+            await bot.answer_callback_query(call.id, "❌ Ошибка при подтверждении платежа.")
+            return
+
+        await bot.answer_callback_query(call.id, "✅ Платёж подтверждён и записан в базу данных.")
+        await bot.edit_message_caption(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            caption=call.message.caption + "\n\n✅ ПЛАТЁЖ ПОДТВЕРЖДЁН",
+            reply_markup=None  # Remove the button
+        )
+        if registration.get('telegram_id'):
+            try:
+                outbox.send_message(int(registration['telegram_id']), PAYMENT_CONFIRMED_TEXT)
+            except Exception as e:
+                print(f"Error notifying user: {e}")
+    except Exception as e:
+        print(f"Error in payment confirmation: {e}")
+        await bot.answer_callback_query(call.id, "❌ Произошла ошибка.")
+
+@timed_handler
+async def process_full_name(message, state):
+    chat_id = message.chat.id
+    await conversations.update(chat_id, full_name=message.text, step='email')
+    await bot.send_message(chat_id, "Пожалуйста, напишите свою электронную почту")
+
+@timed_handler
+async def process_email(message, state):
+    chat_id = message.chat.id
+    email = message.text.strip()
+
+    if not validate_email(email):
+        await bot.send_message(chat_id, "❗ Пожалуйста, введите корректный email.")
+        return
+
+    await conversations.update(chat_id, email=email, step='phone')
+    await bot.send_message(chat_id, "Пожалуйста, напишите свой номер телефона")
+
+@timed_handler
+async def process_phone(message, state):
+    chat_id = message.chat.id
+    phone = message.text.strip()
+
+    if not validate_phone_number(phone):
+        await bot.send_message(chat_id, "❗ Пожалуйста, введите корректный номер телефона в формате +7 7XX XXX XX XX.")
+        return
+
+    state = dict(state, phone=format_phone_number(phone))
+
+    # Queue for Supabase; with durable outbox storage it is written in the background
+    if not await asyncio.to_thread(queue_registration, state, chat_id, message.from_user.username):
+        await bot.send_message(chat_id, ERROR_TEXT)
+        return
+
+    outbox.send_message(chat_id, "✅ Регистрация прошла успешно! Вы получите напоминания перед вебинаром.")
+    link = state.get('link')
+    if link:
+        outbox.send_message(chat_id, webinar_registration_text(state['date'], link))
+    # Reminder bookkeeping touches SQLite, keep it off the event loop
+    reg = {
+        'telegram_id': chat_id,
+        'webinar_id': state['date_id']
+    }
+    webinars_by_id = await asyncio.to_thread(get_webinars_by_id)
+    await asyncio.to_thread(schedule_reminders_for_registration, reg, webinars_by_id)
+    # Registration finished, nothing left to remember for this chat
+    await conversations.delete(chat_id)
+
+# Registration step name (stored in the conversation record) -> handler for the chat's next message
+STEP_HANDLERS = {
+    'full_name': process_full_name,
+    'email': process_email,
+    'phone': process_phone,
+    'course_full_name': process_course_full_name,
+    'course_phone': process_course_phone,
+    'payment_receipt': process_payment_receipt,
+}
+
+# TESTING: Command to manually schedule reminders for all registrations (for testing with new webinar dates)
+@bot.message_handler(commands=['test_reminders'])
+@timed_handler
+async def test_reminders(message):
+    webinar_catalog.invalidate()
+    await asyncio.to_thread(schedule_all_reminders)
+    await bot.send_message(message.chat.id, "Test: All reminders have been (re)scheduled based on current data.")
+
+# TESTING: Command to manually trigger Google Drive sync
+@bot.message_handler(commands=['test_sync'])
+@timed_handler
+async def test_sync(message):
+    await bot.send_message(message.chat.id, "🔄 Starting manual Google Drive sync...")
+    # Waits for a sync that is already running, so it goes to a worker thread too
+    await asyncio.to_thread(force_full_sync)
+    results = await asyncio.to_thread(sync_all_to_drive)
+    await bot.send_message(message.chat.id, "Manual sync finished:\n" + sync_report(results))
+
+# TESTING: Command to manually trigger course registrations sync only
+@bot.message_handler(commands=['test_course_sync'])
+@timed_handler
+async def test_course_sync(message):
+    await bot.send_message(message.chat.id, "🔄 Starting manual course registrations sync...")
+    result = await asyncio.to_thread(sync_course_registrations_to_drive)
+    await bot.send_message(message.chat.id, "Course registrations sync finished:\n" + sync_report({'course_registrations': result}))
+
+@bot.message_handler(content_types=['photo'])
+@timed_handler
+async def handle_photo(message):
+    chat_id = message.chat.id
+    state = await conversations.get(chat_id)
+    if state and state.get('type') == 'course':
+        # This is a payment receipt for course registration
+        await process_payment_receipt(message, state)
+    else:
+        await bot.send_message(chat_id, "Пожалуйста, используйте команду /start для начала работы с ботом.")
+
+async def close_sessions():
+    await get_async_supabase_client().close()
+    await bot.close_session()
+
+async def main():
+    try:
+        await bot.infinity_polling()
+    finally:
+        await close_sessions()
@@ -0,0 +1,120 @@
+import time
+import asyncio
+import aiohttp
+from metrics import SUPABASE_SECONDS, SUPABASE_ERRORS
+from supabase_utils import (
+    SUPABASE_URL, SUPABASE_KEY, SUPABASE_POOL_SIZE, SUPABASE_TIMEOUT,
+    RETURN_REPRESENTATION, first_row, seen_users, USER_UPSERT_PARAMS, USER_UPSERT_HEADERS,
+    build_payment_update, build_user_row,
+)
+
+
+class AsyncSupabaseClient:
+    """
+    asyncio counterpart of supabase_utils.SupabaseClient, used by async_bot.py.
+
+    One aiohttp.ClientSession with a bounded keep-alive connection pool is
+    created lazily inside the running event loop and shared by all handlers.
+    """
+
+    def __init__(self, url=None, api_key=None, pool_size=SUPABASE_POOL_SIZE, timeout=SUPABASE_TIMEOUT):
+        url = url or SUPABASE_URL
+        api_key = api_key or SUPABASE_KEY
+        if not url or not api_key:
+            raise ValueError("Missing SUPABASE_URL or SUPABASE_API_KEY in environment variables.")
+        self.rest_url = f"{url.rstrip('/')}/rest/v1"
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(connect=timeout[0], sock_read=timeout[1])
+        self.headers = {
+            "apikey": api_key,
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+            )
+        return self._session
+
+    async def request(self, method, table, params=None, json=None, headers=None):
+        """
+        Send a request to /rest/v1/<table>.
+        Returns (status, body) where body is the decoded JSON, or None for empty responses.
+        """
+        session = self._get_session()
+        start = time.perf_counter()
+        try:
+            async with session.request(method, f"{self.rest_url}/{table}", params=params, json=json, headers=headers) as response:
+                text = await response.text()
+                body = await response.json(content_type=None) if text else None
+        except Exception:
+            SUPABASE_ERRORS.inc(method=method, table=table)
+            raise
+        finally:
+            SUPABASE_SECONDS.observe(time.perf_counter() - start, method=method, table=table)
+        if response.status >= 400:
+            SUPABASE_ERRORS.inc(method=method, table=table)
+        return response.status, body
+
+    async def get(self, table, params=None, **kwargs):
+        return await self.request('GET', table, params=params, **kwargs)
+
+    async def post(self, table, json=None, **kwargs):
+        return await self.request('POST', table, json=json, **kwargs)
+
+    async def patch(self, table, json=None, params=None, **kwargs):
+        return await self.request('PATCH', table, json=json, params=params, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+_client = None
+
+def get_async_supabase_client():
+    """
+    Return the process-wide AsyncSupabaseClient, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        _client = AsyncSupabaseClient()
+    return _client
+
+async def update_course_payment_status(registration_id):
+    try:
+        status, body = await get_async_supabase_client().patch(
+            "course_registrations",
+            json=build_payment_update(),
+            params={"id": f"eq.{registration_id}"},
+            headers=RETURN_REPRESENTATION
+        )
+        if status == 200:
+            return first_row(body)
+        print(f"Failed to update payment status: {status} {body}")
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Exception during payment status update: {e}")
+        return None
+
+async def save_user_to_supabase(telegram_id, username=None):
+    # Shares the seen-users cache with supabase_utils
+    if telegram_id in seen_users:
+        return True
+    try:
+        status, body = await get_async_supabase_client().post(
+            "users", json=build_user_row(telegram_id, username), params=USER_UPSERT_PARAMS, headers=USER_UPSERT_HEADERS
+        )
+        if status in (200, 201, 204):
+            seen_users.add(telegram_id)
+            return True
+        print(f"Failed to save user: {status} {body}")
+        return False
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Exception during Supabase user save: {e}")
+        return False
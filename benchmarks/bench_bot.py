@@ -0,0 +1,322 @@
+"""
+End-to-end benchmark of the webinar registration flow, fully offline.
+
+Starts FakePostgREST and FakeTelegram, points the bot at them and feeds the
+real bot.py (or async_bot.py) handlers a synthetic update stream: every chat
+goes /start -> register -> pick a date -> name -> email -> phone, sending its
+next update as soon as the bot has answered the previous one, all chats at
+once. Reports throughput, p50/p99 per-step and end-to-end latency, peak RSS,
+and where handler time went.
+
+    python -m benchmarks.bench_bot --registrations 10000
+    python -m benchmarks.bench_bot --registrations 2000 --runtime async --supabase-latency-ms 30
+
+Run from the repository root. Everything the bot persists goes to a temporary
+directory. Peak RSS is for the whole process, so it includes the stand-ins.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import contextlib
+import resource
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from benchmarks.fake_services import FakePostgREST, FakeTelegram
+
+FIRST_CHAT_ID = 10_000_000
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--registrations', type=int, default=10000, help='concurrent chats registering (default 10000)')
+    parser.add_argument('--webinars', type=int, default=3, help='upcoming webinars to spread registrations over')
+    parser.add_argument('--runtime', choices=('threaded', 'async'), default='threaded')
+    parser.add_argument('--threads', type=int, default=None, help='TeleBot worker threads (default: what bot.py uses)')
+    parser.add_argument('--supabase-latency-ms', type=float, default=0.0)
+    parser.add_argument('--telegram-latency-ms', type=float, default=0.0)
+    parser.add_argument('--batch', type=int, default=100, help='updates per process_new_updates call (like one getUpdates page)')
+    parser.add_argument('--timeout', type=float, default=600.0, help='give up after this many seconds')
+    parser.add_argument('--json', metavar='PATH', help='also write the results as JSON')
+    parser.add_argument('--verbose', action='store_true', help="show the bot's own log output")
+    return parser.parse_args(argv)
+
+def configure_environment(workdir, supabase, telegram):
+    """Point every module at the stand-ins and the temp dir. Must run before the bot modules are imported."""
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '123456:bench',
+        'SUPABASE_URL': supabase.url,
+        'SUPABASE_API_KEY': 'bench',
+        'ADMIN_CHAT_ID': '1',
+        'LOCAL_STATE_DB': os.path.join(workdir, 'bot_state.sqlite'),
+        # Write-behind outbox, as in a deployment with persistent storage
+        'REGISTRATION_OUTBOX_DB': os.path.join(workdir, 'registration_outbox.sqlite'),
+        'REMINDER_DB_PATH': os.path.join(workdir, 'reminders.sqlite'),
+        'CONVERSATION_STORE': 'memory',
+        'METRICS_PORT': '0',
+        # Measure the bot, not Telegram's rate limits
+        'OUTBOUND_GLOBAL_RATE': '1000000',
+    })
+    import telebot.apihelper
+    import telebot.asyncio_helper
+    telebot.apihelper.API_URL = telegram.api_url
+    telebot.asyncio_helper.API_URL = telegram.api_url
+
+def seed_webinars(supabase, count):
+    start = datetime.now() + timedelta(days=7)
+    webinars = [
+        {'id': i, 'date': (start + timedelta(days=i)).replace(hour=19, minute=0, second=0, microsecond=0).isoformat(),
+         'link': f'https://example.com/webinar/{i}'}
+        for i in range(1, count + 1)
+    ]
+    supabase.seed('webinars', webinars)
+    return [w['id'] for w in webinars]
+
+
+class RegistrationDriver:
+    """
+    Plays one scripted user per chat. A step counts as answered once the bot
+    has sent the expected number of messages back to that chat.
+    """
+
+    def __init__(self, registrations, webinar_ids):
+        self.registrations = registrations
+        self.webinar_ids = webinar_ids
+        self.pending = queue.Queue()
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self._update_ids = iter(range(1, 10 ** 9))
+        self._chats = {}
+        self.step_latencies = []
+        self.registration_latencies = []
+        self.completed = 0
+        self.unexpected = 0
+
+    def script(self, index):
+        chat_id = FIRST_CHAT_ID + index
+        webinar_id = self.webinar_ids[index % len(self.webinar_ids)]
+        # (kind, payload, replies expected)
+        return chat_id, [
+            ('message', '/start', 1),
+            ('callback', 'register', 1),
+            ('callback', f'date_{webinar_id}', 1),
+            ('message', f'Bench User {index}', 1),
+            ('message', f'user{index}@example.com', 1),
+            ('message', f'+7701{index % 10_000_000:07d}', 2),  # confirmation + webinar link
+        ]
+
+    def start(self):
+        for index in range(self.registrations):
+            chat_id, steps = self.script(index)
+            self._chats[chat_id] = {'steps': steps, 'step': 0, 'replies': 0, 'started': None, 'step_started': None}
+        with self._lock:
+            for chat_id in self._chats:
+                self._send_step(chat_id)
+
+    def _send_step(self, chat_id):
+        chat = self._chats[chat_id]
+        now = time.perf_counter()
+        if chat['started'] is None:
+            chat['started'] = now
+        chat['step_started'] = now
+        kind, payload, _ = chat['steps'][chat['step']]
+        self.pending.put((chat_id, kind, payload))
+
+    def on_send(self, chat_id, method, params):
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            if chat is None or chat['step'] >= len(chat['steps']):
+                self.unexpected += 1
+                return
+            chat['replies'] += 1
+            if chat['replies'] < chat['steps'][chat['step']][2]:
+                return
+            now = time.perf_counter()
+            self.step_latencies.append(now - chat['step_started'])
+            chat['step'] += 1
+            chat['replies'] = 0
+            if chat['step'] == len(chat['steps']):
+                self.registration_latencies.append(now - chat['started'])
+                self.completed += 1
+                if self.completed == self.registrations:
+                    self.done.set()
+                return
+            self._send_step(chat_id)
+
+    def build_update(self, chat_id, kind, payload):
+        import telebot
+        user = {'id': chat_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'bench{chat_id}'}
+        chat = {'id': chat_id, 'type': 'private'}
+        update_id = next(self._update_ids)
+        if kind == 'message':
+            body = {'update_id': update_id, 'message': {
+                'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': payload}}
+        else:
+            body = {'update_id': update_id, 'callback_query': {
+                'id': str(update_id), 'chat_instance': 'bench', 'data': payload, 'from': user,
+                'message': {'message_id': 1, 'date': int(time.time()), 'chat': chat, 'text': 'menu'}}}
+        return telebot.types.Update.de_json(body)
+
+    def feed(self, dispatch, batch):
+        """Pull pending steps and hand them to the bot in getUpdates-sized batches until done."""
+        while not self.done.is_set():
+            try:
+                items = [self.pending.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            while len(items) < batch:
+                try:
+                    items.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            dispatch([self.build_update(*item) for item in items])
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    supabase = FakePostgREST(latency=args.supabase_latency_ms / 1000).start()
+    telegram = FakeTelegram(latency=args.telegram_latency_ms / 1000).start()
+    webinar_ids = seed_webinars(supabase, args.webinars)
+    configure_environment(workdir, supabase, telegram)
+
+    import bot
+    from metrics import HANDLER_SECONDS, SUPABASE_SECONDS
+    from conversation_state import conversations
+    from reminder_scheduler import scheduler
+    from registration_outbox import registration_outbox
+
+    driver = RegistrationDriver(args.registrations, webinar_ids)
+    telegram.on_send = driver.on_send
+    scheduler.start()
+    registration_outbox.start()
+
+    loop = None
+    if args.runtime == 'async':
+        import asyncio
+        import async_bot
+        loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=loop.run_forever, name='bench-loop', daemon=True)
+        loop_thread.start()
+
+        def dispatch(updates):
+            asyncio.run_coroutine_threadsafe(async_bot.bot.process_new_updates(updates), loop)
+    else:
+        import telebot
+        if args.threads:
+            bot.bot.worker_pool = telebot.util.ThreadPool(bot.bot, num_threads=args.threads)
+        dispatch = bot.bot.process_new_updates
+
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    feeder = threading.Thread(target=driver.feed, args=(dispatch, args.batch), name='bench-feeder', daemon=True)
+    feeder.start()
+    driver.start()
+    finished = driver.done.wait(args.timeout)
+    elapsed = time.perf_counter() - started
+    # The last reply goes out before process_phone schedules reminders and clears the conversation,
+    # so let in-flight handlers finish before tearing the scheduler down
+    drain_deadline = time.monotonic() + 10
+    while finished and len(conversations) and time.monotonic() < drain_deadline:
+        time.sleep(0.05)
+    # Replies no longer wait for Supabase; rows_saved counts what the outbox has written by now
+    while finished and registration_outbox.stats()['pending'] and time.monotonic() < drain_deadline:
+        time.sleep(0.05)
+
+    updates = sum(len(driver._chats[c]['steps'][:driver._chats[c]['step']]) for c in driver._chats)
+    registrations_saved = len(supabase.rows('registrations'))
+    results = {
+        'runtime': args.runtime,
+        'registrations': args.registrations,
+        'completed': driver.completed,
+        'finished': finished,
+        'elapsed_seconds': round(elapsed, 3),
+        'registrations_per_second': round(driver.completed / elapsed, 1),
+        'updates_per_second': round(updates / elapsed, 1),
+        'step_latency_ms': {
+            'p50': round(percentile(driver.step_latencies, 50) * 1000, 2),
+            'p99': round(percentile(driver.step_latencies, 99) * 1000, 2),
+        },
+        'registration_latency_ms': {
+            'p50': round(percentile(driver.registration_latencies, 50) * 1000, 2),
+            'p99': round(percentile(driver.registration_latencies, 99) * 1000, 2),
+        },
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'peak_rss_before_run_mb': round(rss_before, 1),
+        'rows_saved': registrations_saved,
+        'conversations_left': len(conversations),
+        'supabase_requests': supabase.requests,
+        'telegram_calls': telegram.calls,
+        'handlers_ms': {
+            key[0]: {'count': count, 'mean': round(total / count * 1000, 3)}
+            for key, (count, total) in sorted(HANDLER_SECONDS.summary().items()) if count
+        },
+        'supabase_ms': {
+            f"{key[0]} {key[1]}": {'count': count, 'mean': round(total / count * 1000, 3)}
+            for key, (count, total) in sorted(SUPABASE_SECONDS.summary().items()) if count
+        },
+    }
+
+    driver.done.set()
+    if loop is not None:
+        # Close the aiohttp sessions on their own loop, then stop and close the loop
+        asyncio.run_coroutine_threadsafe(async_bot.close_sessions(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join(timeout=10)
+        loop.close()
+    scheduler.shutdown(wait=False)
+    supabase.stop()
+    telegram.stop()
+    return results
+
+def print_report(results):
+    print()
+    print(f"Runtime:              {results['runtime']}")
+    print(f"Registrations:        {results['completed']}/{results['registrations']}"
+          f"{'' if results['finished'] else '  (TIMED OUT)'}")
+    print(f"Wall time:            {results['elapsed_seconds']} s")
+    print(f"Throughput:           {results['registrations_per_second']} registrations/s, "
+          f"{results['updates_per_second']} updates/s")
+    print(f"Step latency:         p50 {results['step_latency_ms']['p50']} ms, p99 {results['step_latency_ms']['p99']} ms")
+    print(f"Registration latency: p50 {results['registration_latency_ms']['p50']} ms, "
+          f"p99 {results['registration_latency_ms']['p99']} ms")
+    print(f"Peak RSS:             {results['peak_rss_mb']} MiB (before run {results['peak_rss_before_run_mb']} MiB)")
+    print(f"Rows saved:           {results['rows_saved']}, conversations left in memory: {results['conversations_left']}")
+    print(f"Requests:             {results['supabase_requests']} Supabase, {results['telegram_calls']} Telegram")
+    print("Handlers (count, mean ms):")
+    for name, stats in results['handlers_ms'].items():
+        print(f"  {name:<28} {stats['count']:>8} {stats['mean']:>10}")
+    print("Supabase calls (count, mean ms):")
+    for name, stats in results['supabase_ms'].items():
+        print(f"  {name:<28} {stats['count']:>8} {stats['mean']:>10}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.verbose:
+        results = run(args)
+    else:
+        # The bot logs several lines per registration; keep them out of the report (they are still paid for)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results = run(args)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0 if results['finished'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
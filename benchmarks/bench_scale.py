@@ -0,0 +1,247 @@
+"""
+Scale benchmark for the code paths that grow with the registration tables:
+reminder scheduling at startup and the Excel export done by every Drive sync.
+
+For each table size N it generates N synthetic registrations spread over M
+upcoming webinars and measures, each in a fresh process so peak memory is
+attributable to one scenario:
+
+  schedule_all       schedule_all_reminders() on an empty job store (first
+                     start), then again on the populated store (restart)
+  per_registration   schedule_reminders_for_registration() for a sample of
+                     registrations, one call each, like the bot does after
+                     every sign-up
+  export             create_excel_file() with N rows, then update_excel_sheet()
+                     rewriting Sheet1 of that N-row workbook (a full sync)
+
+Supabase reads are replaced by in-memory fixtures and nothing talks to the
+network: SUPABASE_URL points at a closed port, so a call that slipped past
+the fixtures fails loudly instead of skewing the numbers.
+
+    python -m benchmarks.bench_scale --registrations 1000,10000,100000 --webinars 20
+    python -m benchmarks.bench_scale --registrations 500000 --scenarios export --json scale.json
+
+Run from the repository root. Job stores, attendee index and workbooks go to
+a temporary directory.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+from datetime import datetime, timedelta, timezone
+
+SCENARIOS = ('schedule_all', 'per_registration', 'export')
+FIRST_CHAT_ID = 10_000_000
+
+
+def rss_mb():
+    """Current resident set size."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / (1024 * 1024)
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def make_webinars(count):
+    start = datetime.now() + timedelta(days=7)
+    return [
+        {'id': i, 'date': (start + timedelta(days=i)).replace(hour=19, minute=0, second=0, microsecond=0).isoformat(),
+         'link': f'https://example.com/webinar/{i}'}
+        for i in range(1, count + 1)
+    ]
+
+def iter_synthetic_registrations(count, webinar_count, select='*'):
+    """
+    Rows shaped like the 'registrations' table, oldest first, generated on the
+    fly so the fixture itself does not hold N rows in memory.
+    """
+    columns = None if select == '*' else ['id'] + [c for c in select.split(',') if c != 'id']
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(1, count + 1):
+        webinar_id = (i - 1) % webinar_count + 1
+        row = {
+            'id': i,
+            'created_at': (base + timedelta(seconds=i)).isoformat(),
+            'telegram_id': str(FIRST_CHAT_ID + i),
+            'full_name': f'Участник {i}',
+            'email': f'user{i}@example.com',
+            'phone': f'+7701{i:07d}',
+            'webinar_date': None,
+            'webinar_id': webinar_id,
+        }
+        yield row if columns is None else {c: row[c] for c in columns}
+
+def configure_environment(workdir):
+    """Must run before the bot modules are imported."""
+    os.environ.update({
+        'SUPABASE_URL': 'http://127.0.0.1:9',
+        'SUPABASE_API_KEY': 'bench',
+        'LOCAL_STATE_DB': os.path.join(workdir, 'bot_state.sqlite'),
+        'REMINDER_DB_PATH': os.path.join(workdir, 'reminders.sqlite'),
+        'METRICS_PORT': '0',
+    })
+
+
+def _install_reminder_fixtures(reminder_scheduler, registrations, webinar_count):
+    webinars = make_webinars(webinar_count)
+    webinars_by_id = {str(w['id']): w for w in webinars}
+
+    def iter_attendees(webinar_ids, page_size=None):
+        wanted = {int(webinar_id) for webinar_id in webinar_ids}
+        for row in iter_synthetic_registrations(registrations, webinar_count, 'telegram_id,webinar_id'):
+            if row['webinar_id'] in wanted:
+                yield row
+
+    reminder_scheduler.get_webinars_by_id = lambda: dict(webinars_by_id)
+    reminder_scheduler.get_upcoming_webinars = lambda now=None: list(webinars)
+    reminder_scheduler.iter_attendees = iter_attendees
+    return webinars_by_id
+
+def bench_schedule_all(registrations, webinar_count, **_):
+    import reminder_scheduler
+    _install_reminder_fixtures(reminder_scheduler, registrations, webinar_count)
+    # Paused: jobs are stored and looked up exactly as in production but never fire
+    reminder_scheduler.scheduler.start(paused=True)
+    try:
+        start = time.perf_counter()
+        reminder_scheduler.schedule_all_reminders()
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        reminder_scheduler.schedule_all_reminders()
+        warm = time.perf_counter() - start
+        jobs = len(reminder_scheduler.scheduler.get_jobs(jobstore=reminder_scheduler.REMINDER_JOBSTORE))
+    finally:
+        reminder_scheduler.scheduler.shutdown(wait=False)
+    return {'cold_seconds': cold, 'warm_seconds': warm, 'jobs': jobs}
+
+def bench_per_registration(registrations, webinar_count, sample, **_):
+    import reminder_scheduler
+    webinars_by_id = _install_reminder_fixtures(reminder_scheduler, registrations, webinar_count)
+    reminder_scheduler.scheduler.start(paused=True)
+    try:
+        # The attendee index already holds everyone else, as it would in a long-running bot
+        reminder_scheduler.schedule_all_reminders()
+        calls = min(sample, registrations)
+        rows = iter_synthetic_registrations(calls, webinar_count)
+        latencies = []
+        start = time.perf_counter()
+        for row in rows:
+            row['telegram_id'] = str(int(row['telegram_id']) + registrations)  # new chats, not re-registrations
+            t = time.perf_counter()
+            reminder_scheduler.schedule_reminders_for_registration(row, webinars_by_id)
+            latencies.append(time.perf_counter() - t)
+        total = time.perf_counter() - start
+    finally:
+        reminder_scheduler.scheduler.shutdown(wait=False)
+    latencies.sort()
+    return {
+        'calls': calls,
+        'total_seconds': total,
+        'mean_ms': total / calls * 1000 if calls else 0.0,
+        'p99_ms': latencies[int(0.99 * (len(latencies) - 1))] * 1000 if latencies else 0.0,
+    }
+
+def bench_export(registrations, webinar_count, workdir, **_):
+    import sync_registrations_to_drive as drive_sync
+    path = os.path.join(workdir, drive_sync.EXCEL_FILE_NAME)
+    start = time.perf_counter()
+    drive_sync.create_excel_file(path, iter_synthetic_registrations(registrations, webinar_count), drive_sync.REGISTRATION_COLUMNS)
+    create = time.perf_counter() - start
+    size = os.path.getsize(path)
+    # A full sync rewrites Sheet1 with the whole table (by default the old workbook is not read back)
+    start = time.perf_counter()
+    count = drive_sync.update_excel_sheet(path, iter_synthetic_registrations(registrations, webinar_count), drive_sync.REGISTRATION_COLUMNS)
+    update = time.perf_counter() - start
+    return {'create_seconds': create, 'update_seconds': update, 'rows': count, 'file_mb': size / (1024 * 1024)}
+
+BENCHMARKS = {
+    'schedule_all': bench_schedule_all,
+    'per_registration': bench_per_registration,
+    'export': bench_export,
+}
+
+
+def _run_in_child(scenario, params, results):
+    with tempfile.TemporaryDirectory(prefix='bench-scale-') as workdir:
+        configure_environment(workdir)
+        sys.path.insert(0, os.getcwd())
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            # Import cost is not measured
+            for module in ('reminder_scheduler', 'sync_registrations_to_drive'):
+                importlib.import_module(module)
+            baseline = rss_mb()
+            try:
+                result = BENCHMARKS[scenario](workdir=workdir, **params)
+            except Exception as e:
+                results.put({'error': f'{type(e).__name__}: {e}'})
+                return
+        result['peak_rss_mb'] = peak_rss_mb()
+        result['rss_growth_mb'] = result['peak_rss_mb'] - baseline
+        results.put(result)
+
+def run_scenario(scenario, params):
+    """Run one scenario in a fresh interpreter and return its result dict."""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_in_child, args=(scenario, params, results))
+    process.start()
+    process.join()
+    if not results.empty():
+        return results.get()
+    return {'error': f'worker exited with code {process.exitcode}'}
+
+def format_result(scenario, result):
+    if 'error' in result:
+        return f"ERROR {result['error']}"
+    memory = f"peak RSS {result['peak_rss_mb']:.0f} MB (+{result['rss_growth_mb']:.0f} MB)"
+    if scenario == 'schedule_all':
+        return f"first start {result['cold_seconds']:.2f}s, restart {result['warm_seconds']:.2f}s, {result['jobs']} jobs, {memory}"
+    if scenario == 'per_registration':
+        return (f"{result['calls']} calls in {result['total_seconds']:.2f}s, "
+                f"mean {result['mean_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, {memory}")
+    return (f"create {result['create_seconds']:.2f}s, full rewrite {result['update_seconds']:.2f}s, "
+            f"{result['rows']} rows, {result['file_mb']:.2f} MB file, {memory}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--registrations', default='1000,10000,100000',
+                        help='comma-separated table sizes to run (default 1000,10000,100000)')
+    parser.add_argument('--webinars', type=int, default=20, help='upcoming webinars to spread registrations over')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument('--sample', type=int, default=5000,
+                        help='schedule_reminders_for_registration calls per size (default 5000)')
+    parser.add_argument('--json', metavar='PATH', help='also write the results as JSON')
+    args = parser.parse_args(argv)
+    args.registrations = [int(n) for n in args.registrations.split(',')]
+    args.scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = []
+    for registrations in args.registrations:
+        for scenario in args.scenarios:
+            params = {'registrations': registrations, 'webinar_count': args.webinars, 'sample': args.sample}
+            start = time.perf_counter()
+            result = run_scenario(scenario, params)
+            result.update(scenario=scenario, registrations=registrations, webinars=args.webinars,
+                          wall_seconds=time.perf_counter() - start)
+            report.append(result)
+            print(f"N={registrations:<8} {scenario:<17} {format_result(scenario, result)}", flush=True)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if any('error' in r for r in report) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
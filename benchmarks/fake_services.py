@@ -0,0 +1,344 @@
+"""
+Local stand-ins for the two services the bot talks to, for offline benchmarks.
+
+FakePostgREST serves /rest/v1/<table> with the subset of PostgREST the bot
+uses: eq/neq/gt/gte/lt/lte/in/is filters (also inside or=/and= groups),
+select, order, limit, on_conflict
+with resolution=ignore-duplicates and Prefer: return=representation. Tests
+can make it fail the next requests (fail()) or act as if a column had not
+been migrated yet (missing_columns).
+
+FakeTelegram serves /bot<token>/<method> for the Bot API methods the bot
+calls and reports every outgoing message to an on_send callback, which is
+how the benchmarks observe replies.
+
+Both run a ThreadingHTTPServer on 127.0.0.1 in a daemon thread and can add
+a fixed per-request latency to imitate a real network round trip.
+"""
+import re
+import json
+import time
+import itertools
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so the bot's pooled sessions reuse connections like they would in production
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms per request
+    disable_nagle_algorithm = True
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        service = self.server.service
+        if service.latency:
+            time.sleep(service.latency)
+        status, payload = service.handle(self.command, self.path, self.headers, body)
+        data = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _dispatch
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _FakeService:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._server = None
+        self.port = None
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.service = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+
+def _split_terms(group):
+    """Split the inside of an or=(...)/and=(...) group on its top-level commas."""
+    terms, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(group):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and char == ',' and depth == 0:
+            terms.append(group[start:i])
+            start = i + 1
+    terms.append(group[start:])
+    return terms
+
+
+def _coerce(text, sample):
+    """Turn a filter argument into the type of the column value it is compared with."""
+    if text == 'null':
+        return None
+    if isinstance(sample, bool):
+        return text == 'true'
+    if isinstance(sample, int):
+        try:
+            return int(text.strip('"'))
+        except ValueError:
+            return text
+    return text.strip('"')
+
+
+class FakePostgREST(_FakeService):
+    def __init__(self, latency=0.0, tables=None):
+        super().__init__(latency)
+        self._lock = threading.Lock()
+        self.tables = {name: list(rows) for name, rows in (tables or {}).items()}
+        self._ids = itertools.count(1)
+        self._unique = {}  # (table, column) -> set of values, built on first on_conflict use
+        self._failures = []  # (status, payload) answers for the next requests
+        # table -> columns that do not exist; using one is answered like PostgREST does (42703)
+        self.missing_columns = {}
+        self.requests = 0
+
+    def seed(self, table, rows):
+        with self._lock:
+            self.tables.setdefault(table, []).extend(rows)
+
+    def rows(self, table):
+        with self._lock:
+            return list(self.tables.get(table, []))
+
+    def reset(self):
+        """Forget all tables, pending failures and missing columns."""
+        with self._lock:
+            self.tables.clear()
+            self._unique.clear()
+            self._failures.clear()
+            self.missing_columns.clear()
+
+    def fail(self, status, payload=None, times=1):
+        """Answer the next `times` requests with status and payload instead of serving them."""
+        with self._lock:
+            self._failures.extend([(status, payload or {'message': 'injected failure'})] * times)
+
+    def _undefined_column(self, table, control, body):
+        missing = self.missing_columns.get(table)
+        if not missing:
+            return None
+        used = set(control.get('select', '').split(',')) | {control.get('on_conflict')}
+        rows = json.loads(body or b'[]') if body else []
+        for row in (rows if isinstance(rows, list) else [rows]):
+            used.update(row)
+        undefined = sorted(missing & used)
+        if not undefined:
+            return None
+        return {'code': '42703', 'message': f'column {table}.{undefined[0]} does not exist'}
+
+    def _matches(self, row, filters):
+        for column, expr in filters:
+            if column in ('or', 'and'):
+                results = [self._matches_term(row, term) for term in _split_terms(expr[1:-1])]
+                if not (any(results) if column == 'or' else all(results)):
+                    return False
+                continue
+            op, _, arg = expr.partition('.')
+            value = row.get(column)
+            if op == 'in':
+                if value not in [_coerce(a, value) for a in arg.strip('()').split(',')]:
+                    return False
+                continue
+            if op == 'is':
+                if (value is None) != (arg == 'null'):
+                    return False
+                continue
+            arg = _coerce(arg, value)
+            if op == 'eq' and not value == arg:
+                return False
+            if op == 'neq' and not value != arg:
+                return False
+            if value is None and op in ('gt', 'gte', 'lt', 'lte'):
+                return False
+            if op == 'gt' and not value > arg:
+                return False
+            if op == 'gte' and not value >= arg:
+                return False
+            if op == 'lt' and not value < arg:
+                return False
+            if op == 'lte' and not value <= arg:
+                return False
+        return True
+
+    def _matches_term(self, row, term):
+        # Either a nested group, and(...)/or(...), or column.op.arg
+        logic, _, group = term.partition('(')
+        if group and logic in ('or', 'and'):
+            return self._matches(row, [(logic, '(' + group)])
+        column, _, expr = term.partition('.')
+        return self._matches(row, [(column, expr)])
+
+    def handle(self, method, path, headers, body):
+        parsed = urlparse(path)
+        match = re.match(r'^/rest/v1/(\w+)$', parsed.path)
+        if not match:
+            return 404, {'message': 'not found'}
+        table = match.group(1)
+        params = parse_qsl(parsed.query, keep_blank_values=True)
+        control = {k: v for k, v in params if k in ('select', 'order', 'limit', 'offset', 'on_conflict')}
+        filters = [(k, v) for k, v in params if k not in control]
+        prefer = headers.get('Prefer', '')
+        representation = 'return=representation' in prefer
+        self.requests += 1
+
+        with self._lock:
+            if self._failures:
+                return self._failures.pop(0)
+            error = self._undefined_column(table, control, body)
+            if error:
+                return 400, error
+            rows = self.tables.setdefault(table, [])
+            if method == 'GET':
+                result = [row for row in rows if self._matches(row, filters)]
+                for key in reversed((control.get('order') or '').split(',')):
+                    if key:
+                        column, _, direction = key.partition('.')
+                        result.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=direction == 'desc')
+                offset = int(control.get('offset', 0))
+                if 'limit' in control:
+                    result = result[offset:offset + int(control['limit'])]
+                elif offset:
+                    result = result[offset:]
+                if control.get('select', '*') != '*':
+                    columns = control['select'].split(',')
+                    result = [{c: row.get(c) for c in columns} for row in result]
+                return 200, result
+
+            if method == 'POST':
+                new_rows = json.loads(body or b'[]')
+                if isinstance(new_rows, dict):
+                    new_rows = [new_rows]
+                conflict = control.get('on_conflict')
+                seen = None
+                if conflict:
+                    seen = self._unique.get((table, conflict))
+                    if seen is None:
+                        seen = self._unique[(table, conflict)] = {r.get(conflict) for r in rows}
+                inserted = []
+                for row in new_rows:
+                    if seen is not None:
+                        if row.get(conflict) in seen:
+                            if 'resolution=ignore-duplicates' in prefer:
+                                continue
+                            return 409, {'message': 'duplicate key value violates unique constraint'}
+                        seen.add(row.get(conflict))
+                    row = dict(row)
+                    row.setdefault('id', next(self._ids))
+                    row.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+                    rows.append(row)
+                    inserted.append(row)
+                return 201, (inserted if representation else None)
+
+            if method == 'PATCH':
+                changes = json.loads(body or b'{}')
+                updated = []
+                for row in rows:
+                    if self._matches(row, filters):
+                        row.update(changes)
+                        updated.append(dict(row))
+                return (200, updated) if representation else (204, None)
+
+        return 405, {'message': f'{method} not supported'}
+
+
+class FakeTelegram(_FakeService):
+    """
+    on_send(chat_id, method, params) is called for every message the bot sends
+    (sendMessage, sendPhoto, sendVideoNote), from the server's request thread.
+    """
+
+    SEND_METHODS = ('sendMessage', 'sendPhoto', 'sendVideoNote', 'sendVideo', 'sendDocument')
+
+    def __init__(self, latency=0.0, on_send=None):
+        super().__init__(latency)
+        self.on_send = on_send
+        self._message_ids = itertools.count(1)
+        self.calls = 0
+
+    @property
+    def api_url(self):
+        """Value for telebot.apihelper.API_URL / telebot.asyncio_helper.API_URL."""
+        return self.url + '/bot{0}/{1}'
+
+    def _params(self, path, headers, body):
+        parsed = urlparse(path)
+        params = dict(parse_qsl(parsed.query, keep_blank_values=True))
+        content_type = headers.get('Content-Type', '')
+        if body and 'application/x-www-form-urlencoded' in content_type:
+            params.update(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+        elif body and 'application/json' in content_type:
+            params.update(json.loads(body))
+        elif body and 'multipart/form-data' in content_type:
+            # Only plain fields matter here; uploaded file parts are ignored
+            for name, value in re.findall(rb'name="([^"]+)"\r\n\r\n(.*?)\r\n--', body, re.S):
+                params[name.decode()] = value.decode('utf-8', 'replace')
+        return params
+
+    def _message(self, chat_id, params, method):
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        if 'text' in params:
+            message['text'] = params['text']
+        if 'caption' in params:
+            message['caption'] = params['caption']
+        file_id = f"file-{message['message_id']}"
+        if method == 'sendVideoNote':
+            message['video_note'] = {'file_id': file_id, 'file_unique_id': file_id, 'length': 240, 'duration': 5}
+        elif method == 'sendPhoto':
+            message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 800, 'height': 600}]
+        return message
+
+    def handle(self, method, path, headers, body):
+        match = re.match(r'^/bot[^/]+/(\w+)', urlparse(path).path)
+        if not match:
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+        api_method = match.group(1)
+        params = self._params(path, headers, body)
+        self.calls += 1
+
+        if api_method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}}
+        if api_method == 'answerCallbackQuery':
+            return 200, {'ok': True, 'result': True}
+        if api_method in self.SEND_METHODS or api_method.startswith('edit'):
+            chat_id = int(params.get('chat_id', 0))
+            message = self._message(chat_id, params, api_method)
+            if self.on_send and api_method in self.SEND_METHODS:
+                self.on_send(chat_id, api_method, params)
+            return 200, {'ok': True, 'result': message}
+        if api_method in ('getUpdates', 'deleteWebhook', 'setWebhook'):
+            return 200, {'ok': True, 'result': [] if api_method == 'getUpdates' else True}
+        return 200, {'ok': True, 'result': True}
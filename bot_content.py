@@ -0,0 +1,286 @@
+import re
+from datetime import datetime
+from telebot import types
+
+# Texts, keyboards and input helpers shared by the threaded (bot.py) and asyncio (async_bot.py) runtimes
+
+# Input validation functions
+def validate_phone_number(phone):
+    """
+    Validate Kazakhstan phone number format.
+    Accepts: +7 707 123 45 67, 87071234567, 8 (707) 123-45-67, +77071234567
+    """
+    # Remove all non-digit characters except +
+    cleaned = re.sub(r'[^\d+]', '', phone)
+    
+    # Check for valid Kazakhstan mobile number patterns
+    patterns = [
+        r'^\+77\d{9}$',  # +77071234567
+        r'^87\d{9}$',    # 87071234567
+    ]
+    
+    for pattern in patterns:
+        if re.match(pattern, cleaned):
+            return True
+    
+    return False
+
+
+
+def validate_email(email):
+    """
+    Validate email format using regex.
+    """
+    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+    return re.match(pattern, email) is not None
+
+def format_phone_number(phone):
+    """
+    Format phone number to standard Kazakhstan format: +7 7XX XXX XX XX
+    """
+    # Remove all non-digit characters
+    cleaned = re.sub(r'[^\d]', '', phone)
+    
+    # If it starts with 8, replace with +7
+    if cleaned.startswith('8'):
+        cleaned = '7' + cleaned[1:]
+    
+    # If it doesn't start with 7, add +7
+    if not cleaned.startswith('7'):
+        cleaned = '7' + cleaned
+    
+    # Format as +7 7XX XXX XX XX
+    if len(cleaned) == 11 and cleaned.startswith('7'):
+        return f"+7 {cleaned[1:4]} {cleaned[4:7]} {cleaned[7:9]} {cleaned[9:11]}"
+    
+    return phone  # Return original if can't format
+
+# Russian month names
+RUSSIAN_MONTHS = {
+    1: 'января', 2: 'февраля', 3: 'марта', 4: 'апреля',
+    5: 'мая', 6: 'июня', 7: 'июля', 8: 'августа',
+    9: 'сентября', 10: 'октября', 11: 'ноября', 12: 'декабря'
+}
+
+def format_webinar_date(date_str):
+    """
+    Format an ISO webinar date in Russian, e.g. "26 июля 10:00".
+    Falls back to the raw value if it cannot be parsed.
+    """
+    try:
+        dt = datetime.fromisoformat(date_str)
+        return f"{dt.day} {RUSSIAN_MONTHS[dt.month]} {dt.strftime('%H:%M')}"
+    except Exception:
+        return str(date_str)
+
+WELCOME_TEXT = """Привет! 👋  
+Мы — команда Wowmotion. Здесь ты получишь всю информацию о вебинаре и обучающем курсе.
+
+Выбери, что тебя интересует:"""
+
+WEBINAR_WELCOME_TEXT = "Добро пожаловать в бот для вебинаров!"
+
+COURSE_TEXT = """👨‍🏫 Это обучающий курс на 5 недель для тех, кто хочет освоить спортивную съёмку и начать зарабатывать.
+Идеально для начинающих и тех, кто уже фотографирует, но хочет освоить новое направление."""
+
+COURSE_HOW_TEXT = """📆 Обучение длится 4 недели + 1 неделя практика  
+🧠 Формат: видеоуроки + разборы + домашние задания  
+📍 Всё проходит онлайн, с поддержкой куратора"""
+
+COURSE_PROGRAM_TEXT = """📚 ПРОГРАММА КУРСА
+
+🔹 Блок 1: Введение в спортивную фотографию
+
+🎬 Понимание жанра и потенциала
+
+— Что такое спортивная съёмка и в чём её уникальность
+— Кто заказывает спортивные фото и где они нужны
+— Примеры успешных работ и направлений
+— Почему это востребовано и как начать даже без опыта
+
+⸻
+
+🔹 Блок 2: Основы фотографии
+
+📸 Техническая база, без которой не обойтись
+
+— Камера, объективы, аксессуары
+— Выдержка, диафрагма, ISO, фокус
+— Свет, композиция и цвет
+— Как подготовиться к съёмке
+
+⸻
+
+🔹 Блок 3: Съёмка спорта на практике
+
+🎯 Всё о том, как поймать момент и снять динамику
+
+— Как снимать разные виды спорта (гимнастика, танцы, бокс и др.)
+— Как выбрать точку съёмки и не мешать соревнованию
+— Настройки камеры в сложных условиях
+— Секреты «идеального кадра» в движении
+
+⸻
+
+🔹 Блок 4: Работа с клиентами и организация съёмок
+
+🤝 Как стать востребованным фотографом
+
+— Как общаться с клиентами: спортсмены, родители, тренеры
+— Как выстраивать съёмочный процесс
+— Как брать заказы и продавать фото
+— Типичные ошибки и как их избежать
+
+⸻
+
+🔹 Блок 5: Практика, портфолио и рост
+
+🚀 Старт твоей карьеры
+
+— Практическая съёмка с куратором
+— Анализ и обратная связь
+— Как собрать портфолио
+— Как развиваться в этом направлении и попасть в команду WOWMOTION
+— Именной сертификат по завершению
+⸻
+"""
+
+COURSE_PAYMENT_TEXT = """💰 Полная стоимость курса: 150,000₸  
+🎁 Бонус: участие в закрытом чате, сертификат и поддержка после курса  
+💵 Оплата на Kaspi / переводом  
+📍 Место бронируется после оплаты
+
+Есть вопросы? Напиши нам в Instagram или WhatsApp:
+📸 @wowmotion_photo_video
+📞 [номер WhatsApp]
+Мы на связи и рады помочь!"""
+
+COURSE_FAQ_TEXT = """❓ ЧАСТО ЗАДАВАЕМЫЕ ВОПРОСЫ
+
+🟢 Я новичок. Мне подойдёт курс?
+— Да! Курс подходит для начинающих и тех, кто хочет новое направление.
+
+🟢 У меня нет крутой камеры.
+— Подойдёт любая камера — главное начать! Мы подскажем, как работать с тем, что у тебя есть.
+
+🟢 Будет ли сертификат?
+— Да, при прохождении всех занятий и практике — ты получаешь именной сертификат.
+
+🟢 Я пропустил вебинар. Будет запись?
+— Да, всем участникам вебинара отправим запись."""
+
+PAYMENT_INSTRUCTIONS_TEXT = """💳 ИНСТРУКЦИИ ПО ОПЛАТЕ
+
+💰 Стоимость курса: 150,000₸
+
+📱 Оплата через Kaspi:
+• Ссылка: https://pay.kaspi.kz/pay/s6llvgtb
+• Получатель: [WowMotion]
+• Назначение: Курс спортивной съёмки
+
+
+📸 После оплаты, пожалуйста, отправьте фото чека для подтверждения."""
+
+RECEIPT_RECEIVED_TEXT = """✅ Спасибо! Ваш чек получен. Мы проверим оплату и свяжемся с вами в течение 24 часов.
+            Есть вопросы? Напиши нам в Instagram или WhatsApp:
+            📸 @wowmotion_photo_video
+            📞 [+7 (706) 651-22-93, +7 (705) 705-82-75]
+            Мы на связи и рады помочь!"""
+
+PAYMENT_CONFIRMED_TEXT = "🎉 Ваша оплата подтверждена! Спасибо за регистрацию. Мы свяжемся с вами в ближайшее время."
+
+ERROR_TEXT = "⚠️ Что-то пошло не так. Пожалуйста, попробуйте снова позже."
+TEXT_ONLY_TEXT = "✍️ Пожалуйста, ответьте текстовым сообщением."
+
+def webinar_registration_text(date_str, link):
+    formatted_date = format_webinar_date(date_str)
+    return f"""🎥 Вебинар "Секреты спортивной съёмки"
+📅 Дата: {formatted_date}
+📍 Формат: онлайн
+👤 Организатор: @wowmotion_photo_video
+
+🔓 Что вас ждёт:
+— Как красиво снимать спорт в движении
+— Настройки камеры для разных условий
+— Подготовка к турниру: техника, команда, настроение
+— Как передать силу, эмоции и динамику кадра
+— Ошибки новичков и как их избежать
+— Советы по обработке спортивных фото
+— Как зарабатывать на спортивной съёмке
+
+📢 Подпишитесь на наш Telegram-канал, чтобы не пропустить анонсы, материалы и запись вебинара: https://t.me/wowdancechannel
+
+🎁 В конце вебинара — подарок и сертификат участника
+{link}"""
+
+def course_registration_admin_text(data, registration_id):
+    text = f"""🎓 Новая регистрация на курс!
+
+👤 Имя: {data['full_name']}
+📱 Телефон: {data['phone']}
+🆔 Username: @{data['telegram_username']}
+📚 План: Спортивный Фотограф (5 недель)
+💰 Статус: Ожидает подтверждения оплаты
+📅 Дата регистрации: {datetime.now().strftime('%d.%m.%Y %H:%M')}"""
+    if registration_id:
+        text += f"\n🆔 ID регистрации: {registration_id}"
+    else:
+        text += "\n⚠️ ID регистрации: Не удалось получить (требуется ручная проверка)"
+    return text
+
+def main_menu_markup():
+    markup = types.InlineKeyboardMarkup()
+    webinar_btn = types.InlineKeyboardButton('📅 Вебинар', callback_data='webinar_main')
+    course_btn = types.InlineKeyboardButton('📸 Обучающий курс', callback_data='course_main')
+    markup.add(webinar_btn, course_btn)
+    return markup
+
+def webinar_menu_markup():
+    markup = types.InlineKeyboardMarkup()
+    register_btn = types.InlineKeyboardButton('Зарегистрироваться', callback_data='register')
+    markup.add(register_btn)
+    return markup
+
+def course_menu_markup():
+    markup = types.InlineKeyboardMarkup()
+    how_btn = types.InlineKeyboardButton('📖 Как проходит обучение', callback_data='course_how')
+    program_btn = types.InlineKeyboardButton('📚 Программа курса', callback_data='course_program')
+    payment_btn = types.InlineKeyboardButton('💳 Стоимость и оплата', callback_data='course_payment')
+    faq_btn = types.InlineKeyboardButton('❓ Вопрос–ответ', callback_data='course_faq')
+    markup.add(how_btn, program_btn, payment_btn, faq_btn)
+    return markup
+
+def back_to_course_markup():
+    markup = types.InlineKeyboardMarkup()
+    back_btn = types.InlineKeyboardButton('Назад', callback_data='course_main')
+    markup.add(back_btn)
+    return markup
+
+def course_payment_markup():
+    markup = types.InlineKeyboardMarkup()
+    pay_btn = types.InlineKeyboardButton('🔐 Оплатить курс', callback_data='course_pay')
+    back_btn = types.InlineKeyboardButton('Назад', callback_data='course_main')
+    markup.add(pay_btn, back_btn)
+    return markup
+
+def webinar_dates_markup(dates):
+    markup = types.InlineKeyboardMarkup()
+    for date in dates:
+        btn = types.InlineKeyboardButton(
+            text=format_webinar_date(date['date']),
+            callback_data=f"date_{date['id']}"
+        )
+        markup.add(btn)
+    return markup
+
+def confirm_payment_markup(registration_id):
+    # Only offer the button if we have a real ID to confirm
+    if not registration_id:
+        return None
+    markup = types.InlineKeyboardMarkup()
+    confirm_btn = types.InlineKeyboardButton(
+        '✅ Подтвердить оплату',
+        callback_data=f'confirm_{registration_id}'
+    )
+    markup.add(confirm_btn)
+    return markup
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from local_state import LOCAL_STATE_DB
+
+# Per-chat registration state ("conversations"), shared by both bot runtimes.
+# A record is a small dict: the current step plus the answers collected so far, e.g.
+#   {'step': 'email', 'date': '...', 'date_id': 3, 'link': '...', 'full_name': '...'}
+# Records expire after CONVERSATION_TTL_SECONDS without an update, and at most
+# CONVERSATION_MAX_ENTRIES are kept (least recently updated go first), so abandoned
+# registrations no longer accumulate.
+
+load_dotenv()
+CONVERSATION_STORE = os.getenv('CONVERSATION_STORE', 'memory')  # 'memory' or 'sqlite'
+CONVERSATION_DB_PATH = os.getenv('CONVERSATION_DB_PATH', LOCAL_STATE_DB)
+# A course registration waits for the payment receipt, which can take a while
+CONVERSATION_TTL_SECONDS = int(os.getenv('CONVERSATION_TTL_SECONDS', str(24 * 3600)))
+CONVERSATION_MAX_ENTRIES = int(os.getenv('CONVERSATION_MAX_ENTRIES', '10000'))
+# Per-chat locks are striped over a fixed pool so they never need cleaning up
+CONVERSATION_LOCK_STRIPES = 64
+
+
+class _ChatLocks:
+    """
+    Fixed pool of locks; a chat always maps to the same one. Two chats may share
+    a lock, which only costs a little concurrency.
+    """
+
+    def __init__(self, stripes=CONVERSATION_LOCK_STRIPES):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def __call__(self, chat_id):
+        return self._locks[hash(chat_id) % len(self._locks)]
+
+
+class MemoryConversationStore:
+    """
+    In-process store. Records are kept in update order, so expired entries and
+    entries over the cap are always at the front and eviction is cheap.
+    """
+
+    def __init__(self, ttl_seconds=CONVERSATION_TTL_SECONDS, max_entries=CONVERSATION_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = _ChatLocks()
+        self._mutex = threading.Lock()
+        self._records = OrderedDict()  # chat_id -> (updated_at, record)
+
+    def get(self, chat_id):
+        """Return a copy of the chat's record, or None if there is none or it expired."""
+        with self._mutex:
+            entry = self._records.get(chat_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._records[chat_id]
+                return None
+            return dict(entry[1])
+
+    def set(self, chat_id, record):
+        with self._mutex:
+            self._records[chat_id] = (time.monotonic(), dict(record))
+            self._records.move_to_end(chat_id)
+            self._evict()
+
+    def update(self, chat_id, **fields):
+        """Merge fields into the chat's record (creating it if needed) and return the result."""
+        with self._mutex:
+            entry = self._records.get(chat_id)
+            record = dict(entry[1]) if entry and time.monotonic() - entry[0] <= self.ttl_seconds else {}
+            record.update(fields)
+            self._records[chat_id] = (time.monotonic(), record)
+            self._records.move_to_end(chat_id)
+            self._evict()
+            return dict(record)
+
+    def delete(self, chat_id):
+        with self._mutex:
+            self._records.pop(chat_id, None)
+
+    def __len__(self):
+        with self._mutex:
+            return len(self._records)
+
+    def _evict(self):
+        # Caller holds _mutex
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._records:
+            updated_at, _ = next(iter(self._records.values()))
+            if len(self._records) <= self.max_entries and updated_at >= deadline:
+                break
+            self._records.popitem(last=False)
+
+
+class SQLiteConversationStore:
+    """
+    Store backed by SQLite, so a registration in progress survives a restart.
+    Records are stored as compact JSON; expired rows are pruned on write.
+    """
+
+    # Trim to max_entries every this many writes (counting rows on every write is wasteful)
+    TRIM_EVERY = 100
+
+    def __init__(self, path=CONVERSATION_DB_PATH, ttl_seconds=CONVERSATION_TTL_SECONDS, max_entries=CONVERSATION_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = _ChatLocks()
+        self._mutex = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "chat_id INTEGER PRIMARY KEY, record TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at)")
+
+    def get(self, chat_id):
+        """Return the chat's record, or None if there is none or it expired."""
+        with self._mutex:
+            row = self._conn.execute(
+                "SELECT record FROM conversations WHERE chat_id = ? AND updated_at >= ?",
+                (chat_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, chat_id, record):
+        with self._mutex:
+            self._write(chat_id, record)
+
+    def update(self, chat_id, **fields):
+        """Merge fields into the chat's record (creating it if needed) and return the result."""
+        with self._mutex:
+            row = self._conn.execute(
+                "SELECT record FROM conversations WHERE chat_id = ? AND updated_at >= ?",
+                (chat_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+            record = json.loads(row[0]) if row else {}
+            record.update(fields)
+            self._write(chat_id, record)
+            return record
+
+    def delete(self, chat_id):
+        with self._mutex:
+            self._conn.execute("DELETE FROM conversations WHERE chat_id = ?", (chat_id,))
+
+    def __len__(self):
+        with self._mutex:
+            return self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def _write(self, chat_id, record):
+        # Caller holds _mutex
+        now = time.time()
+        self._conn.execute(
+            "INSERT INTO conversations (chat_id, record, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET record = excluded.record, updated_at = excluded.updated_at",
+            (chat_id, json.dumps(record, separators=(',', ':')), now),
+        )
+        self._conn.execute("DELETE FROM conversations WHERE updated_at < ?", (now - self.ttl_seconds,))
+        self._writes += 1
+        if self._writes % self.TRIM_EVERY == 0:
+            self._conn.execute(
+                "DELETE FROM conversations WHERE chat_id IN ("
+                "SELECT chat_id FROM conversations ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+def create_conversation_store(kind=CONVERSATION_STORE):
+    if kind == 'sqlite':
+        return SQLiteConversationStore()
+    if kind == 'memory':
+        return MemoryConversationStore()
+    raise ValueError(f"Unknown CONVERSATION_STORE '{kind}', expected 'memory' or 'sqlite'")
+
+
+conversations = create_conversation_store()
+
+# Message types routed to a pending registration step. Steps outside PHOTO_STEPS only take text;
+# dispatch_step answers anything else with TEXT_ONLY_TEXT and keeps the step.
+STEP_CONTENT_TYPES = ['text', 'photo', 'document', 'video', 'sticker', 'voice', 'audio', 'contact', 'location']
+PHOTO_STEPS = {'payment_receipt'}
+
+def has_pending_step(chat_id):
+    state = conversations.get(chat_id)
+    return bool(state and state.get('step'))
+
+def is_command(message):
+    return bool(message.text and message.text.startswith('/'))
+
+def routes_to_step(message):
+    """True if the message goes to the chat's pending step. Commands (/start etc.) always reach their own handlers."""
+    return not is_command(message) and has_pending_step(message.chat.id)
+
+def step_accepts(step, message):
+    return step in PHOTO_STEPS or message.text is not None
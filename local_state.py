@@ -0,0 +1,41 @@
+import os
+import json
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+LOCAL_STATE_DB = os.getenv('LOCAL_STATE_DB', 'bot_state.sqlite')
+
+
+class LocalState:
+    """
+    Small JSON key-value store on SQLite for bookkeeping that has to survive
+    restarts (sync cursors and similar). Not meant for bulk data.
+    """
+
+    def __init__(self, path=LOCAL_STATE_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO kv (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, json.dumps(value)),
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+
+local_state = LocalState()
@@ -0,0 +1,136 @@
+import os
+import asyncio
+import hashlib
+import threading
+from dotenv import load_dotenv
+from local_state import local_state
+
+load_dotenv()
+
+# Local media files the bot sends, with the env var that may already hold a file_id for them
+COURSE_CIRCLE_VIDEO = os.getenv('CIRCLE_VIDEO_PATH', 'media/intro_circle.mp4')
+WEBINAR_CIRCLE_VIDEO = os.getenv('CIRCLE_VIDEO_PATH2', 'media/intro_circle2.mp4')
+CIRCLE_VIDEOS = {
+    COURSE_CIRCLE_VIDEO: 'CIRCLE_VIDEO_FILE_ID',
+    WEBINAR_CIRCLE_VIDEO: 'CIRCLE_VIDEO_FILE_ID2',
+}
+
+# Telegram send method per media kind; the uploaded file_id is read from message.<kind>
+SEND_METHODS = {
+    'video_note': 'send_video_note',
+    'video': 'send_video',
+    'photo': 'send_photo',
+    'document': 'send_document',
+}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_file_with_sha256(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data, hashlib.sha256(data).hexdigest()
+
+
+class MediaRegistry:
+    """
+    Persistent map of local media path -> Telegram file_id (plus the content hash
+    it was uploaded with), kept in local_state under "media:<path>".
+
+    Handlers only ever send by cached file_id. Bytes are uploaded once, by
+    prewarm() at startup, when a file has no file_id yet or its content changed.
+    """
+
+    def __init__(self, state=local_state):
+        self._state = state
+        self._lock = threading.Lock()
+        self._file_ids = {}
+
+    def file_id(self, path):
+        """Cached file_id for path, or None if it has not been uploaded yet."""
+        file_id = self._file_ids.get(path)
+        if file_id is None:
+            entry = self._state.get(f"media:{path}")
+            if entry:
+                file_id = entry['file_id']
+                with self._lock:
+                    self._file_ids[path] = file_id
+        return file_id
+
+    def remember(self, path, file_id, sha256=None):
+        self._state.set(f"media:{path}", {'file_id': file_id, 'sha256': sha256})
+        with self._lock:
+            self._file_ids[path] = file_id
+
+    def forget(self, path):
+        """Drop a file_id Telegram no longer accepts; the next prewarm uploads the file again."""
+        self._state.delete(f"media:{path}")
+        with self._lock:
+            self._file_ids.pop(path, None)
+
+    def upload(self, bot, chat_id, path, kind='video_note'):
+        """Upload path to chat_id and remember the resulting file_id. Returns the file_id."""
+        if not chat_id:
+            raise ValueError("ADMIN_CHAT_ID is needed to upload media")
+        sha256 = file_sha256(path)
+        with open(path, 'rb') as f:
+            message = getattr(bot, SEND_METHODS[kind])(chat_id, f)
+        return self._remember_upload(path, message, kind, sha256)
+
+    async def upload_async(self, bot, chat_id, path, kind='video_note'):
+        """upload() for AsyncTeleBot; file and local state I/O run in worker threads."""
+        if not chat_id:
+            raise ValueError("ADMIN_CHAT_ID is needed to upload media")
+        data, sha256 = await asyncio.to_thread(read_file_with_sha256, path)
+        message = await getattr(bot, SEND_METHODS[kind])(chat_id, data)
+        return await asyncio.to_thread(self._remember_upload, path, message, kind, sha256)
+
+    def _remember_upload(self, path, message, kind, sha256):
+        media = getattr(message, kind)
+        if kind == 'photo':
+            media = media[-1]  # largest size
+        self.remember(path, media.file_id, sha256)
+        print(f"📤 Uploaded {path}, file_id cached.")
+        return media.file_id
+
+    def ensure(self, bot, chat_id, path, kind='video_note', seed_file_id=None):
+        """
+        Make sure path has a current file_id, uploading only when it is missing
+        or the file changed since it was uploaded. seed_file_id (e.g. from an
+        env var) is trusted for the current content if nothing is cached yet.
+        """
+        entry = self._state.get(f"media:{path}")
+        if not os.path.exists(path):
+            if entry is None and seed_file_id:
+                self.remember(path, seed_file_id)
+            return self.file_id(path)
+
+        sha256 = file_sha256(path)
+        if entry is None and seed_file_id:
+            self.remember(path, seed_file_id, sha256)
+            return seed_file_id
+        if entry and entry.get('sha256') in (sha256, None):
+            if entry.get('sha256') is None:
+                # Seeded without a hash (file was absent then); adopt the current content
+                self.remember(path, entry['file_id'], sha256)
+            return self.file_id(path)
+        return self.upload(bot, chat_id, path, kind)
+
+    def prewarm(self, bot, chat_id, media=None, kind='video_note'):
+        """
+        ensure() every file in media (path -> env var holding a known file_id).
+        Failures are logged per file; sends for that file are skipped until it succeeds.
+        """
+        for path, env_var in (media or CIRCLE_VIDEOS).items():
+            try:
+                self.ensure(bot, chat_id, path, kind, seed_file_id=os.getenv(env_var) or None)
+            except Exception as e:
+                print(f"⚠️ Warning: Could not prepare media {path}: {e}")
+
+
+media_registry = MediaRegistry()
@@ -0,0 +1,237 @@
+import os
+import time
+import bisect
+import inspect
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+# In-process metrics (counters, latency histograms, callback gauges) served in
+# Prometheus text format. Recording is a lock plus a couple of integer updates,
+# so it is cheap enough for every handler and every Supabase call.
+
+load_dotenv()
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))  # 0 disables the endpoint
+
+# Seconds; covers cache hits through slow Drive uploads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[n] for n in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels[n] for n in self.labelnames))
+        return series[-1] if series else 0
+
+    def summary(self):
+        """{label values: (count, sum)} for every series, e.g. for a benchmark report."""
+        with self._lock:
+            return {key: (series[-1], series[-2]) for key, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Metric whose values are read from a function at scrape time (e.g. queue stats
+    another module already keeps). fn returns an iterable of (labels dict, value).
+    """
+
+    def __init__(self, name, help, type, fn):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        try:
+            samples = list(self.fn())
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            return []
+        for labels, value in samples:
+            lines.append(f"{self.name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(name, lambda: Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(name, lambda: Histogram(name, help, labelnames, buckets))
+
+    def register_callback(self, name, help, type, fn):
+        with self._lock:
+            self._metrics[name] = CallbackMetric(name, help, type, fn)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+HANDLER_SECONDS = registry.histogram('bot_handler_seconds', 'Time spent in a bot handler', ('handler',))
+HANDLER_ERRORS = registry.counter('bot_handler_errors_total', 'Bot handlers that raised', ('handler',))
+SUPABASE_SECONDS = registry.histogram('supabase_request_seconds', 'Supabase REST call latency', ('method', 'table'))
+SUPABASE_ERRORS = registry.counter('supabase_errors_total', 'Supabase REST calls that failed or returned >= 400', ('method', 'table'))
+DRIVE_SECONDS = registry.histogram('drive_call_seconds', 'Google Drive call latency', ('call',))
+DRIVE_ERRORS = registry.counter('drive_errors_total', 'Google Drive calls that raised', ('call',))
+DRIVE_SYNCS = registry.counter('drive_syncs_total', 'Drive sync runs by outcome (full, delta, skipped)', ('table', 'result'))
+REMINDERS_SCHEDULED = registry.counter('reminders_scheduled_total', 'Reminder jobs added or moved', ('kind',))
+REMINDERS_CANCELLED = registry.counter('reminders_cancelled_total', 'Reminder jobs cancelled after a webinar was moved or removed', ('kind',))
+REMINDERS_SENT = registry.counter('reminders_sent_total', 'Reminder messages Telegram accepted', ('kind',))
+OUTBOX_ROWS = registry.counter('registration_outbox_rows_total', 'Queued registration rows by flush outcome (sent, retried, failed)', ('table', 'result'))
+
+
+def timed(histogram, errors=None, **labels):
+    """
+    Decorator recording the call duration in histogram (and exceptions in errors).
+    Works for plain functions and coroutine functions.
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(**labels)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - start, **labels)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+def timed_handler(fn):
+    """Record a bot handler's latency under its function name."""
+    return timed(HANDLER_SECONDS, HANDLER_ERRORS, handler=fn.__name__)(fn)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are not worth a log line each
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Serve /metrics from a daemon thread. Returns the server, or None when disabled (port 0).
+    """
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return server
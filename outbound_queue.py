@@ -0,0 +1,209 @@
+import os
+import queue
+import threading
+import time
+import requests
+from dotenv import load_dotenv
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+from metrics import registry
+
+load_dotenv()
+TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+
+# Telegram allows ~30 messages/second overall and about 1 message/second per chat
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '25'))
+OUTBOUND_PER_CHAT_RATE = 1.0
+OUTBOUND_PER_CHAT_BURST = 3
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', '4'))
+OUTBOUND_QUEUE_SIZE = int(os.getenv('OUTBOUND_QUEUE_SIZE', '50000'))
+OUTBOUND_MAX_RETRIES = 5
+
+
+class TokenBucket:
+    """
+    Classic token bucket. reserve() always takes a token and returns how long
+    the caller has to wait before it may use it, so waiting callers are served
+    in order instead of polling.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def is_idle(self):
+        """True once the bucket has refilled completely, i.e. it can be forgotten."""
+        with self._lock:
+            elapsed = time.monotonic() - self.updated
+            return self.tokens + elapsed * self.rate >= self.capacity
+
+
+class OutboundQueue:
+    """
+    Rate-limited queue for outgoing bot calls (reminders, confirmations, admin notifications).
+
+    Each chat is pinned to one worker thread, so messages to the same chat keep
+    their order. A global token bucket keeps the bot under Telegram's overall
+    limit and a per-chat bucket under the per-chat one. 429 responses pause all
+    workers for the retry_after Telegram asks for and the call is retried.
+    """
+
+    def __init__(self, bot, workers=OUTBOUND_WORKERS, queue_size=OUTBOUND_QUEUE_SIZE,
+                 global_rate=OUTBOUND_GLOBAL_RATE, max_retries=OUTBOUND_MAX_RETRIES):
+        self.bot = bot
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._queues = [queue.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._paused_until = 0.0
+        self._stats_lock = threading.Lock()
+        self._stats = {'sent': 0, 'failed': 0, 'dropped': 0, 'retried': 0, 'rate_limited': 0}
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for index, q in enumerate(self._queues):
+                thread = threading.Thread(target=self._worker, args=(q,), name=f"outbound-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=10):
+        """
+        Let the workers finish what is already queued, then stop them.
+        """
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, chat_id, method, *args, block=False, on_sent=None, **kwargs):
+        """
+        Queue bot.<method>(chat_id, *args, **kwargs).
+        With block=True the caller waits for free space (use from background jobs);
+        otherwise a full queue drops the call. Returns True if it was queued.
+        on_sent() is called from the worker once Telegram has accepted the call.
+        """
+        if not self._threads:
+            self.start()
+        q = self._queues[hash(chat_id) % len(self._queues)]
+        try:
+            q.put((chat_id, method, args, kwargs, on_sent), block=block)
+            return True
+        except queue.Full:
+            self._count('dropped')
+            print(f"[WARNING] Outbound queue full, dropped {method} to {chat_id}")
+            return False
+
+    def send_message(self, chat_id, text, block=False, on_sent=None, **kwargs):
+        return self.enqueue(chat_id, 'send_message', text, block=block, on_sent=on_sent, **kwargs)
+
+    def send_photo(self, chat_id, photo, block=False, on_sent=None, **kwargs):
+        return self.enqueue(chat_id, 'send_photo', photo, block=block, on_sent=on_sent, **kwargs)
+
+    def stats(self):
+        """
+        Counters plus current queue depth, for monitoring.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['depth'] = sum(q.qsize() for q in self._queues)
+        return stats
+
+    def _pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _wait_for_slot(self, chat_bucket):
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+        delay = max(chat_bucket.reserve(), self._global_bucket.reserve())
+        if delay > 0:
+            time.sleep(delay)
+
+    def _worker(self, q):
+        # Per-chat buckets are worker-local because a chat always lands on the same worker
+        chat_buckets = {}
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                return
+            chat_id = item[0]
+            bucket = chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = chat_buckets[chat_id] = TokenBucket(OUTBOUND_PER_CHAT_RATE, OUTBOUND_PER_CHAT_BURST)
+            try:
+                self._deliver(item, bucket)
+            finally:
+                q.task_done()
+            if len(chat_buckets) > 10000:
+                for idle_chat_id in [c for c, b in chat_buckets.items() if b.is_idle()]:
+                    del chat_buckets[idle_chat_id]
+
+    def _deliver(self, item, chat_bucket):
+        chat_id, method, args, kwargs, on_sent = item
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count('retried')
+            self._wait_for_slot(chat_bucket)
+            try:
+                getattr(self.bot, method)(chat_id, *args, **kwargs)
+                self._count('sent')
+                if on_sent is not None:
+                    on_sent()
+                return
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                    self._count('rate_limited')
+                    self._pause(retry_after)
+                    continue
+                if e.error_code >= 500:
+                    time.sleep(min(2 ** attempt, 30))
+                    continue
+                # 400/403 etc. (chat not found, bot blocked by user) will not succeed on retry
+                self._count('failed')
+                print(f"Failed to {method} to {chat_id}: {e}")
+                return
+            except (requests.ConnectionError, requests.Timeout) as e:
+                print(f"Network error on {method} to {chat_id}, retrying: {e}")
+                time.sleep(min(2 ** attempt, 30))
+            except Exception as e:
+                self._count('failed')
+                print(f"Failed to {method} to {chat_id}: {e}")
+                return
+        self._count('dropped')
+        print(f"[WARNING] Giving up on {method} to {chat_id} after {self.max_retries} retries")
+
+
+# Shared queue for everything the bot sends outside the normal request/response flow
+outbox = OutboundQueue(TeleBot(TOKEN))
+
+registry.register_callback(
+    'outbound_messages_total', 'Outbound queue results by outcome', 'counter',
+    lambda: [({'result': key}, value) for key, value in outbox.stats().items() if key != 'depth'],
+)
+registry.register_callback(
+    'outbound_queue_depth', 'Messages waiting in the outbound queue', 'gauge',
+    lambda: [({}, outbox.stats()['depth'])],
+)
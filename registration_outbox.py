@@ -0,0 +1,379 @@
+import os
+import json
+import atexit
+import time
+import uuid
+import sqlite3
+import threading
+from dotenv import load_dotenv
+from local_state import LOCAL_STATE_DB
+from metrics import registry, OUTBOX_ROWS
+from supabase_utils import get_supabase_client, build_registration_row, build_course_registration_row
+
+# Write-behind queue for registrations: a sign-up is committed to a local SQLite
+# outbox and confirmed to the user right away, and a background flusher sends
+# pending rows to Supabase in batched array inserts, retrying with backoff while
+# Supabase is slow or down. Rows survive restarts until Supabase has them.
+#
+# Every row carries an idempotency key, so a batch that reached Supabase but whose
+# answer was lost can simply be sent again. The insert is an upsert that ignores
+# rows whose key already exists. Schema:
+#   course_registrations: the UUID primary key `id` is generated here
+#   registrations:        ALTER TABLE registrations ADD COLUMN idempotency_key UUID UNIQUE;
+#
+# The key columns are checked when the flusher starts. Until the registrations
+# migration has run, its rows go out as plain inserts without the key (what the bot
+# did before the outbox), so a retried batch may then be inserted twice.
+#
+# Queued rows leave created_at to the database default, so a row flushed late still
+# sorts after the Drive sync cursor (see sync_registrations_to_drive.py).
+#
+# The outbox holds registrations users were already told succeeded, so it is only
+# write-behind when REGISTRATION_OUTBOX_DB points at storage that survives a restart
+# or deploy (e.g. a mounted volume). Without it the outbox lives in the local state
+# file, which may sit on an ephemeral filesystem (a Heroku-style worker), and every
+# row is sent to Supabase before add() returns; only rows Supabase did not take wait
+# there for a retry. On shutdown (SIGTERM included, see bot.py) one last flush is attempted.
+
+load_dotenv()
+REGISTRATION_OUTBOX_DB = os.getenv('REGISTRATION_OUTBOX_DB', LOCAL_STATE_DB)
+# Write-behind only when the outbox was given its own (persistent) location
+OUTBOX_WRITE_BEHIND = bool(os.getenv('REGISTRATION_OUTBOX_DB'))
+# Seconds between flushes when nothing new was queued (a new row wakes the flusher at once)
+OUTBOX_FLUSH_SECONDS = float(os.getenv('OUTBOX_FLUSH_SECONDS', '5'))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+# Retry delay doubles per failed attempt, up to this many seconds
+OUTBOX_MAX_BACKOFF_SECONDS = 300
+# Supabase answers that mean "try again later". Besides overload and timeouts these are auth,
+# permission and schema errors (a rotated key, a missing column): an operator fixes them and
+# the same rows then go through. Only errors about a row's own data reject it.
+RETRYABLE_STATUS = {401, 403, 404, 408, 425, 429}
+# Error codes of a 400 that point at the schema or the request rather than the row:
+# PostgREST's own (PGRSTxxx) and PostgreSQL class 42 (undefined column or table,
+# no unique constraint for on_conflict, insufficient privilege)
+RETRYABLE_ERROR_PREFIXES = ('PGRST', '42')
+UNDEFINED_COLUMN = '42703'
+
+# Table -> column holding the idempotency key (the upsert's on_conflict target)
+OUTBOX_KEY_COLUMNS = {
+    'registrations': 'idempotency_key',
+    'course_registrations': 'id',
+}
+OUTBOX_UPSERT_HEADERS = {"Prefer": "resolution=ignore-duplicates,return=minimal"}
+
+
+def retry_delay(attempts):
+    return min(OUTBOX_MAX_BACKOFF_SECONDS, 2 ** attempts)
+
+def error_code(response):
+    """PostgREST error code of a failed response ('42703', 'PGRST204', ...), or ''."""
+    try:
+        return str(response.json().get('code') or '')
+    except (ValueError, AttributeError):
+        return ''
+
+def is_retryable(response):
+    if response.status_code >= 500 or response.status_code in RETRYABLE_STATUS:
+        return True
+    return error_code(response).startswith(RETRYABLE_ERROR_PREFIXES)
+
+
+class RegistrationOutbox:
+    """
+    Durable queue of rows waiting to be inserted into Supabase.
+
+    add() writes to SQLite (fsynced), and with write_behind=False also sends the
+    row to Supabase right away, so it is safe to confirm the registration to the
+    user as soon as it returns. flush() sends whatever is due; start() runs it on
+    a background thread. Rows Supabase rejects because
+    of their data are kept, marked failed, for a look by hand; they are queued
+    again on the next start (or with requeue_failed()).
+    """
+
+    def __init__(self, path=REGISTRATION_OUTBOX_DB, batch_size=OUTBOX_BATCH_SIZE, write_behind=OUTBOX_WRITE_BEHIND):
+        self.batch_size = batch_size
+        self.write_behind = write_behind
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        # While Supabase is unreachable the whole outbox backs off, not just the rows that were tried
+        self._failures = 0
+        self._resume_at = 0.0
+        # Tables whose idempotency key column is missing (rows go out as plain inserts);
+        # None until Supabase has been asked
+        self._missing_columns = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL defaults to NORMAL, which may lose the last commits on power loss
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS registration_outbox ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " key TEXT NOT NULL UNIQUE,"
+            " table_name TEXT NOT NULL,"
+            " row TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " failed INTEGER NOT NULL DEFAULT 0,"
+            " last_error TEXT)"
+        )
+        registry.register_callback(
+            'registration_outbox_pending', 'Registrations waiting to be written to Supabase', 'gauge',
+            lambda: [({'state': state}, count) for state, count in self.stats().items()],
+        )
+
+    def add(self, table, row):
+        """
+        Queue a row for insertion into table and return it with its idempotency key set.
+        Raises if the row could not be stored locally.
+        """
+        column = OUTBOX_KEY_COLUMNS[table]
+        row = dict(row)
+        row[column] = key = row.get(column) or str(uuid.uuid4())
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO registration_outbox (key, table_name, row) VALUES (?, ?, ?)",
+                (key, table, json.dumps(row)),
+            )
+        if not self.write_behind:
+            # A failed send leaves the row queued for the flusher, as in write-behind mode
+            self.flush_key(key)
+        else:
+            self._wake.set()
+        return row
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT failed, COUNT(*) FROM registration_outbox GROUP BY failed"
+            ).fetchall()
+        counts = {'pending': 0, 'failed': 0}
+        for failed, count in rows:
+            counts['failed' if failed else 'pending'] = count
+        return counts
+
+    def requeue_failed(self):
+        """Give rows Supabase rejected another try. Returns how many were requeued."""
+        with self._lock:
+            count = self._conn.execute("UPDATE registration_outbox SET failed = 0 WHERE failed = 1").rowcount
+        if count:
+            print(f"Outbox: requeued {count} rows Supabase rejected before")
+            self._wake.set()
+        return count
+
+    def check_schema(self):
+        """
+        Ask Supabase whether every table has its idempotency key column.
+        Returns the set of tables without one, or None if Supabase could not be asked.
+        """
+        client = get_supabase_client()
+        missing = set()
+        for table, column in OUTBOX_KEY_COLUMNS.items():
+            try:
+                response = client.get(table, params={"select": column, "limit": 0})
+            except Exception as e:
+                print(f"Outbox: could not check {table}.{column}: {e}")
+                return None
+            if response.status_code == 400 and error_code(response) == UNDEFINED_COLUMN:
+                missing.add(table)
+            elif response.status_code >= 300:
+                print(f"Outbox: could not check {table}.{column}: {response.status_code} {response.text[:200]}")
+                return None
+        if missing != self._missing_columns:
+            for table in sorted(missing):
+                print(f"⚠️ Outbox: {table}.{OUTBOX_KEY_COLUMNS[table]} is missing in Supabase, {table} rows "
+                      f"are sent as plain inserts and a retry may duplicate them (see registration_outbox.py)")
+            if self._missing_columns and not missing:
+                print("Outbox: idempotency key columns found, retries are safe again")
+        self._missing_columns = missing
+        return missing
+
+    def _pending(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, table_name, row FROM registration_outbox WHERE failed = 0 ORDER BY seq LIMIT ?",
+                (self.batch_size,),
+            ).fetchall()
+
+    def _executemany(self, sql, params):
+        # One transaction (and one fsync) per batch instead of one per row
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(sql, params)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _delete(self, keys):
+        self._executemany("DELETE FROM registration_outbox WHERE key = ?", [(key,) for key in keys])
+
+    def _retry_later(self, entries, error):
+        self._executemany(
+            "UPDATE registration_outbox SET attempts = attempts + 1, last_error = ? WHERE key = ?",
+            [(error, entry[0]) for entry in entries],
+        )
+        self._failures += 1
+        self._resume_at = time.monotonic() + retry_delay(self._failures - 1)
+
+    def _reject(self, entry, error):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE registration_outbox SET attempts = attempts + 1, failed = 1, last_error = ? WHERE key = ?",
+                (error, entry[0]),
+            )
+
+    def _send(self, table, entries):
+        """
+        Insert one batch. Returns (True, None) once Supabase has the rows,
+        (False, error) if the batch is worth retrying, (None, error) if it was rejected.
+        """
+        column = OUTBOX_KEY_COLUMNS[table]
+        rows = [json.loads(row) for _, _, row in entries]
+        if self._missing_columns and table in self._missing_columns:
+            # Not migrated yet: a plain insert without the key
+            for row in rows:
+                row.pop(column, None)
+            params, headers = None, {"Prefer": "return=minimal"}
+        else:
+            params, headers = {"on_conflict": column}, OUTBOX_UPSERT_HEADERS
+        try:
+            response = get_supabase_client().post(table, json=rows, params=params, headers=headers)
+        except Exception as e:
+            return False, str(e)
+        if response.status_code < 300:
+            return True, None
+        error = f"{response.status_code} {response.text[:500]}"
+        if error_code(response) == UNDEFINED_COLUMN:
+            # The schema is not what the last check saw; ask again before the retry
+            self._missing_columns = None
+        if is_retryable(response):
+            return False, error
+        return None, error
+
+    def _flush_batch(self, table, entries):
+        """Send one batch and record the outcome. Returns the number of rows written."""
+        ok, error = self._send(table, entries)
+        if ok:
+            self._failures = 0
+            self._delete([entry[0] for entry in entries])
+            OUTBOX_ROWS.inc(len(entries), table=table, result='sent')
+            return len(entries)
+        if ok is False:
+            self._retry_later(entries, error)
+            OUTBOX_ROWS.inc(len(entries), table=table, result='retried')
+            print(f"Outbox: {len(entries)} {table} rows not written, retrying later: {error}")
+            return 0
+        if len(entries) > 1:
+            # One bad row fails the whole array insert; send them one by one to find it
+            return sum(self._flush_batch(table, [entry]) for entry in entries)
+        self._reject(entries[0], error)
+        OUTBOX_ROWS.inc(table=table, result='failed')
+        print(f"⚠️ Outbox: Supabase rejected {table} row {entries[0][0]}, kept for inspection: {error}")
+        return 0
+
+    def flush_key(self, key):
+        """
+        Send one queued row right away, without waiting for the rows queued before it
+        (e.g. the course registration whose payment the admin is confirming).
+        Returns True if the row is in Supabase (or was never queued).
+        """
+        with self._lock:
+            entry = self._conn.execute(
+                "SELECT key, table_name, row FROM registration_outbox WHERE key = ? AND failed = 0", (str(key),)
+            ).fetchone()
+        # Should the flusher send the same row meanwhile, the upsert ignores the duplicate
+        return entry is None or self._flush_batch(entry[1], [entry]) == 1
+
+    def flush(self):
+        """
+        Send pending rows batch by batch, oldest first, until none are left or
+        Supabase fails (then nothing is sent until the backoff has passed).
+        Returns the number of rows written.
+        """
+        written = 0
+        with self._flush_lock:
+            while time.monotonic() >= self._resume_at:
+                entries = self._pending()
+                if not entries:
+                    break
+                by_table = {}
+                for entry in entries:
+                    by_table.setdefault(entry[1], []).append(entry)
+                for table, batch in by_table.items():
+                    written += self._flush_batch(table, batch)
+                    if time.monotonic() < self._resume_at:
+                        break
+                if len(entries) < self.batch_size:
+                    break
+        return written
+
+    def _run(self):
+        while True:
+            self._wake.wait(OUTBOX_FLUSH_SECONDS)
+            self._wake.clear()
+            try:
+                # Until the columns are known to be there, keep asking (the migration may run any time)
+                if self._missing_columns is None or self._missing_columns:
+                    self.check_schema()
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing registration outbox: {e}")
+
+    def start(self):
+        """
+        Check the schema, requeue rejected rows and start the background flusher
+        (once); rows left over from a previous run go first. A last flush runs at exit.
+        """
+        if self._thread is not None:
+            return
+        if not self.write_behind:
+            print("REGISTRATION_OUTBOX_DB is not set: registrations are sent to Supabase before they are confirmed; "
+                  "point it at persistent storage to confirm them right away")
+        self.requeue_failed()
+        self.check_schema()
+        atexit.register(self.close)
+        self._thread = threading.Thread(target=self._run, name='registration-outbox', daemon=True)
+        self._thread.start()
+        self._wake.set()
+
+    def close(self):
+        """Last flush before exiting, ignoring the backoff; what Supabase does not take stays queued."""
+        self._resume_at = 0.0
+        try:
+            written = self.flush()
+        except Exception as e:
+            print(f"Error flushing registration outbox on shutdown: {e}")
+            return
+        pending = self.stats()['pending']
+        print(f"Outbox: flushed {written} rows on shutdown, {pending} still queued")
+
+
+registration_outbox = RegistrationOutbox()
+
+
+def queue_registration(user_data, telegram_id, username=None):
+    """
+    Queue a webinar registration for Supabase. Returns the queued row, or None if
+    it could not be stored locally either.
+    """
+    try:
+        return registration_outbox.add('registrations', build_registration_row(user_data, telegram_id, username))
+    except Exception as e:
+        print(f"Exception queueing registration: {e}")
+        return None
+
+def queue_course_registration(user_data, telegram_id, username=None):
+    """
+    Queue a course registration for Supabase. The returned row already has its
+    id, so the payment flow can go on before the row is written.
+    Returns None if it could not be stored locally.
+    """
+    row = build_course_registration_row(user_data, telegram_id, username)
+    row.pop('created_at', None)
+    try:
+        return registration_outbox.add('course_registrations', row)
+    except Exception as e:
+        print(f"Exception queueing course registration: {e}")
+        return None
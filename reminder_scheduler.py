@@ -1,77 +1,456 @@
 import os
+import json
+import hashlib
+import sqlite3
+import threading
 from datetime import datetime, timedelta, timezone
+import pytz
+from dateutil import parser
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
-from supabase_utils import fetch_registrations, get_webinar_dates
-from telebot import TeleBot
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from supabase_utils import get_upcoming_webinars, iter_attendees, SUPABASE_PAGE_SIZE
+from webinar_catalog import webinar_catalog
+from outbound_queue import outbox
+from metrics import REMINDERS_SCHEDULED, REMINDERS_SENT, REMINDERS_CANCELLED
 
 # Load environment variables
 load_dotenv()
-TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-bot = TeleBot(TOKEN)
+
+# Reminder jobs are kept on disk so a restart resumes them instead of rebuilding from Supabase
+REMINDER_JOBSTORE = 'reminders'
+REMINDER_DB_PATH = os.getenv('REMINDER_DB_PATH', 'reminders.sqlite')
+REMINDER_JOBSTORE_URL = os.getenv('REMINDER_JOBSTORE_URL', f'sqlite:///{REMINDER_DB_PATH}')
+# Textual reference so persisted jobs resolve no matter which script started the scheduler
+SEND_WEBINAR_REMINDER_REF = 'reminder_scheduler:send_webinar_reminder'
+# Reminders that became due while the bot was down are still sent if they are at most this late
+REMINDER_MISFIRE_GRACE_SECONDS = 30 * 60
+# How often the webinars table is polled for added, moved or removed webinars
+WEBINAR_RECONCILE_SECONDS = int(os.getenv('WEBINAR_RECONCILE_SECONDS', '60'))
+# Naive webinar dates are in this timezone
+WEBINAR_TIMEZONE = pytz.timezone('Asia/Almaty')
 
 # Helper to fetch webinars as a dict by id
 def get_webinars_by_id():
-    webinars = get_webinar_dates()
-    return {str(w['id']): w for w in webinars}
+    return webinar_catalog.by_id()
+
+def send_reminder(chat_id, message, kind):
+    # Blocks while the outbound queue is full so a large fan-out is throttled, not dropped.
+    # Counted once Telegram has taken it; calls the queue gives up on are not.
+    outbox.send_message(chat_id, message, block=True, on_sent=lambda: REMINDERS_SENT.inc(kind=kind))
+
+class ReminderAttendees:
+    """
+    Local index of which chats are registered for which webinar.
+
+    Reminder jobs are scheduled per webinar, not per chat, so this is where a
+    firing job looks up who to send to. It lives next to the job store and
+    survives restarts the same way. A webinar's rows are dropped after its last
+    reminder, or when the reconciler finds it removed or past.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS webinar_attendees ("
+            " webinar_id TEXT NOT NULL,"
+            " chat_id INTEGER NOT NULL,"
+            " PRIMARY KEY (webinar_id, chat_id)"
+            ") WITHOUT ROWID"
+        )
+
+    def add(self, webinar_id, chat_id):
+        self.add_many([(webinar_id, chat_id)])
+
+    def add_many(self, pairs):
+        rows = [(str(webinar_id), int(chat_id)) for webinar_id, chat_id in pairs]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO webinar_attendees (webinar_id, chat_id) VALUES (?, ?)", rows
+            )
+            self._conn.execute("COMMIT")
+
+    def webinar_ids(self, among):
+        """Which of the given webinar ids have at least one attendee."""
+        among = [str(webinar_id) for webinar_id in among]
+        if not among:
+            return set()
+        placeholders = ','.join('?' * len(among))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT DISTINCT webinar_id FROM webinar_attendees WHERE webinar_id IN ({placeholders})", among
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def remove_webinar(self, webinar_id):
+        """Forget a webinar's attendees once it has no reminders left to send."""
+        with self._lock:
+            self._conn.execute("DELETE FROM webinar_attendees WHERE webinar_id = ?", (str(webinar_id),))
+
+    def prune(self, keep):
+        """Drop the attendees of every webinar not in keep. Returns the number of rows deleted."""
+        keep = [str(webinar_id) for webinar_id in keep]
+        placeholders = ','.join('?' * len(keep))
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM webinar_attendees WHERE webinar_id NOT IN ({placeholders})", keep
+            )
+        return cursor.rowcount
+
+    def chat_ids(self, webinar_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chat_id FROM webinar_attendees WHERE webinar_id = ?", (str(webinar_id),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+attendees = ReminderAttendees(REMINDER_DB_PATH)
+
+DAY_BEFORE_TEMPLATE = """Уже завтра! 🚀
+
+{time} начнётся вебинар которого не было в Казахстане. Ты узнаешь секреты спортивной фотосессии.
+
+После вебинара ты уже будешь знать:
+
+✅ Как выйти на стабильную съёмку спортивных мероприятий
+✅ Какие настройки использовать для крутых кадров
+✅ И как сразу получать заказы без рекламы и продвижения
+
+⚠ Записи вебинара не будет — будь онлайн, чтобы не упустить возможности!"""
+
+HOUR_BEFORE_TEMPLATE = """Уже через час! 🔥
+
+Вебинар, которого не было в Казахстане, стартует совсем скоро.
+Ты узнаешь секреты спортивной фотосессии от профи 📸
+
+После вебинара ты уже будешь знать:
+
+✅ Как выйти на стабильную съёмку спортивных мероприятий
+✅ Какие настройки использовать для крутых кадров
+✅ И как сразу получать заказы без рекламы и продвижения
+
+⚠ Записи вебинара не будет — подключайся вовремя и не упусти свой шанс!"""
+
+START_TEMPLATE = """Мы начали! 🎬
+
+Вебинар о спортивной фотосъёмке уже идёт!
+Заходи скорее, чтобы не пропустить полезную информацию и живую демонстрацию.
+
+Ты успеешь узнать:
+
+✅ Как выйти на стабильную съёмку спортивных мероприятий
+✅ Какие настройки использовать для крутых кадров
+✅ И как сразу получать заказы без рекламы и продвижения
+
+⚠ Записи не будет — подключайся прямо сейчас!
+{link}"""
+
+MISSING_LINK_TEXT = "⚠️ Ссылка на вебинар не найдена. Пожалуйста, обратитесь к организатору."
+
+# (kind, how long before the webinar start, message template)
+REMINDER_KINDS = (
+    ('day_before', timedelta(days=1), DAY_BEFORE_TEMPLATE),
+    ('hour_before', timedelta(hours=1), HOUR_BEFORE_TEMPLATE),
+    ('start', timedelta(0), START_TEMPLATE),
+)
+
+# Once this one has fired a webinar's attendees are no longer needed
+LAST_REMINDER_KIND = REMINDER_KINDS[-1][0]
+
+def reminder_job_id(webinar_id, kind):
+    """
+    Stable job id for one reminder of a webinar, so rescheduling replaces instead of duplicating.
+    kind is one of 'day_before', 'hour_before', 'start'.
+    """
+    return f"reminder:{webinar_id}:{kind}"
+
+def parse_webinar_datetime(webinar):
+    """
+    Parse a webinar's date as UTC. Naive dates are treated as WEBINAR_TIMEZONE local time.
+    """
+    dt = parser.isoparse(webinar['date'])
+    # Localize if it's a naive datetime (no tzinfo)
+    if dt.tzinfo is None:
+        dt = WEBINAR_TIMEZONE.localize(dt)
+    # Convert to UTC for proper scheduling
+    return dt.astimezone(timezone.utc)
+
+def render_reminder(kind, webinar, webinar_dt):
+    for reminder_kind, _, template in REMINDER_KINDS:
+        if reminder_kind == kind:
+            return template.format(
+                time=webinar_dt.strftime('%H:%M'),
+                link=webinar.get('link') or MISSING_LINK_TEXT,
+            )
+    raise ValueError(f"Unknown reminder kind: {kind}")
+
+class WebinarSchedule:
+    """
+    Everything reminders need to know about one webinar, computed once: the UTC
+    fire time and the rendered text of each reminder kind. Shared by every
+    registrant of the webinar (see webinar_schedule()).
+    """
+
+    __slots__ = ('webinar_id', 'date', 'link', 'fire_times', 'texts', 'jobs_checked')
+
+    def __init__(self, webinar):
+        self.webinar_id = str(webinar['id'])
+        self.date = webinar['date']
+        self.link = webinar.get('link')
+        webinar_dt = parse_webinar_datetime(webinar)
+        self.fire_times = tuple((kind, webinar_dt - offset) for kind, offset, _ in REMINDER_KINDS)
+        self.texts = {kind: render_reminder(kind, webinar, webinar_dt) for kind, _, _ in REMINDER_KINDS}
+        # Set once schedule_webinar_reminders has made sure the jobs exist for these fire times
+        self.jobs_checked = False
+
+    def matches(self, webinar):
+        return self.date == webinar['date'] and self.link == webinar.get('link')
 
-# Helper to send a message by username
-def send_reminder(telegram_username, message):
-    if not telegram_username:
+_schedules = {}
+_schedules_lock = threading.Lock()
+
+def webinar_schedule(webinar):
+    """
+    Cached WebinarSchedule for a webinar dict, rebuilt when its date or link changes.
+    Raises if the date cannot be parsed.
+    """
+    webinar_id = str(webinar['id'])
+    schedule = _schedules.get(webinar_id)
+    if schedule is None or not schedule.matches(webinar):
+        schedule = WebinarSchedule(webinar)
+        with _schedules_lock:
+            _schedules[webinar_id] = schedule
+    return schedule
+
+def send_webinar_reminder(webinar_id, kind):
+    """
+    Job callback: send the webinar's pre-rendered reminder to every chat registered for it.
+    """
+    webinar = webinar_catalog.get(webinar_id)
+    if not webinar:
+        print(f"[WARNING] Webinar {webinar_id} no longer exists, skipping '{kind}' reminder")
+        attendees.remove_webinar(webinar_id)
         return
-    if not telegram_username.startswith('@'):
-        telegram_username = '@' + telegram_username
+    message = webinar_schedule(webinar).texts[kind]
+    chat_ids = attendees.chat_ids(webinar_id)
+    print(f"Sending '{kind}' reminder for webinar {webinar_id} to {len(chat_ids)} chats")
+    for chat_id in chat_ids:
+        send_reminder(chat_id, message, kind)
+    if kind == LAST_REMINDER_KIND:
+        attendees.remove_webinar(webinar_id)
+
+def schedule_webinar_reminders(webinar):
+    """
+    Make sure the day-before, hour-before and start jobs exist for a webinar.
+    Jobs already scheduled for the right time are left untouched.
+    Returns the number of jobs added, moved or cancelled.
+    """
+    webinar_id = str(webinar['id'])
     try:
-        bot.send_message(telegram_username, message)
+        schedule = webinar_schedule(webinar)
     except Exception as e:
-        print(f"Failed to send message to {telegram_username}: {e}")
+        print(f"Could not parse date for webinar {webinar_id}: {e}")
+        return 0
+    now = datetime.now(timezone.utc)
+    changed = 0
+    # Only schedule reminders that are in the future
+    for kind, remind_time in schedule.fire_times:
+        job_id = reminder_job_id(webinar_id, kind)
+        if remind_time <= now:
+            # The webinar was moved earlier: drop a reminder still waiting for the old, later time
+            # (a job for exactly this time is a late one the scheduler is about to run)
+            existing = scheduler.get_job(job_id, jobstore=REMINDER_JOBSTORE)
+            if existing and existing.next_run_time != remind_time:
+                cancel_reminder_job(existing, "its new time has passed")
+                changed += 1
+            continue
+        existing = scheduler.get_job(job_id, jobstore=REMINDER_JOBSTORE)
+        if existing and existing.next_run_time == remind_time:
+            continue
+        scheduler.add_job(
+            SEND_WEBINAR_REMINDER_REF,
+            'date',
+            run_date=remind_time,
+            args=[webinar_id, kind],
+            id=job_id,
+            jobstore=REMINDER_JOBSTORE,
+            replace_existing=True,
+        )
+        changed += 1
+        REMINDERS_SCHEDULED.inc(kind=kind)
+        print(f"Scheduled '{kind}' reminder for webinar {webinar_id} at {remind_time.isoformat()}")
+    schedule.jobs_checked = True
+    return changed
+
+def cancel_reminder_job(job, reason):
+    scheduler.remove_job(job.id, jobstore=REMINDER_JOBSTORE)
+    REMINDERS_CANCELLED.inc(kind=job.id.rsplit(':', 1)[-1])
+    print(f"Cancelled reminder {job.id}: {reason}")
 
-# Schedule reminders for all registrations
+def schedule_reminders_for_registration(reg, webinars_by_id):
+    chat_id = reg.get('telegram_id')
+    # Only use numeric chat_ids
+    try:
+        chat_id_int = int(chat_id)
+    except (TypeError, ValueError):
+        print(f"[WARNING] Skipping reminder: chat_id is not numeric: {chat_id}")
+        return
+    webinar_id = str(reg.get('webinar_id'))
+    webinar = webinars_by_id.get(webinar_id)
+    if not webinar or not chat_id_int:
+        return
+    attendees.add(webinar_id, chat_id_int)
+    try:
+        schedule = webinar_schedule(webinar)
+    except Exception as e:
+        print(f"Could not parse date for webinar {webinar_id}: {e}")
+        return
+    # Jobs are per webinar, so only the first registrant after a (re)schedule needs to check them
+    if not schedule.jobs_checked:
+        schedule_webinar_reminders(webinar)
+
+# Schedule reminders for all registrations of upcoming webinars
 def schedule_all_reminders():
-    registrations = fetch_registrations()
-    webinars_by_id = get_webinars_by_id()
-    now = datetime.now(timezone.utc)
-    for reg in registrations:
-        username = reg.get('telegram_username')
+    """
+    Rebuild the attendee index and reminder jobs. Only upcoming webinars and the
+    two columns we need of their registrations are fetched, so the cost follows
+    upcoming attendance, not the size of the registration history.
+    """
+    webinars_by_id = {str(webinar['id']): webinar for webinar in get_upcoming_webinars()}
+    if not webinars_by_id:
+        return
+    webinar_ids = set()
+    pairs = []
+    # Write attendees one page at a time
+    for reg in iter_attendees(webinars_by_id):
         webinar_id = str(reg.get('webinar_id'))
-        webinar = webinars_by_id.get(webinar_id)
-        if not webinar:
+        if webinar_id not in webinars_by_id:
             continue
-        # Parse webinar date as UTC-aware
         try:
-            webinar_dt = datetime.fromisoformat(webinar['date'])
-            if webinar_dt.tzinfo is None:
-                webinar_dt = webinar_dt.replace(tzinfo=timezone.utc)
-            else:
-                webinar_dt = webinar_dt.astimezone(timezone.utc)
-        except Exception as e:
-            print(f"Could not parse date for webinar {webinar_id}: {e}")
+            pairs.append((webinar_id, int(reg.get('telegram_id'))))
+        except (TypeError, ValueError):
             continue
-        # Schedule times
-        reminders = [
-            (webinar_dt - timedelta(days=1), f"📅 Reminder: Your webinar is tomorrow at {webinar_dt.strftime('%H:%M')}!"),
-            (webinar_dt - timedelta(hours=1), f"⏳ Just 1 hour left until your webinar!"),
-            (webinar_dt, f"🚀 Your webinar is starting now! Join: {webinar.get('link', '')}")
-        ]
-        for remind_time, msg in reminders:
-            if remind_time > now:
-                scheduler.add_job(send_reminder, 'date', run_date=remind_time, args=[username, msg])
-                print(f"Scheduled reminder for {username} at {remind_time.isoformat()} : {msg}")
-
-# APScheduler setup
-scheduler = BackgroundScheduler(timezone=timezone.utc)
-scheduler.start()
-
-# On import, schedule all reminders
-schedule_all_reminders()
+        webinar_ids.add(webinar_id)
+        if len(pairs) >= SUPABASE_PAGE_SIZE:
+            attendees.add_many(pairs)
+            pairs = []
+    attendees.add_many(pairs)
+    for webinar_id in webinar_ids:
+        schedule_webinar_reminders(webinars_by_id[webinar_id])
 
-# If you want to keep the scheduler running in a standalone script:
-if __name__ == "__main__":
+class WebinarReconciler:
+    """
+    Keeps reminder jobs in line with the webinars table while the bot runs.
+
+    Every WEBINAR_RECONCILE_SECONDS it fetches the upcoming webinars (one small
+    request) and compares a fingerprint of their id, date and link with the last
+    poll; PostgREST has no ETag for this, so the fingerprint plays that role.
+    Only when something changed are jobs touched: moved webinars get their jobs
+    moved, webinars that disappeared get theirs cancelled (and their attendees
+    dropped), and webinars that gained attendees get theirs added. Nothing else
+    is rebuilt.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fingerprint = None
+
+    @staticmethod
+    def fingerprint(webinars):
+        rows = sorted((str(w['id']), str(w['date']), w.get('link') or '') for w in webinars)
+        return hashlib.sha256(json.dumps(rows).encode('utf-8')).hexdigest()
+
+    def poll(self):
+        """Reconcile if the webinars changed since the last poll. Returns the number of jobs changed."""
+        with self._lock:
+            webinars = get_upcoming_webinars()
+            fingerprint = self.fingerprint(webinars)
+            if fingerprint == self._fingerprint:
+                return 0
+            changed = self.reconcile(webinars)
+            self._fingerprint = fingerprint
+        # Handlers should offer the new dates now, not when the catalog TTL runs out
+        webinar_catalog.invalidate()
+        if changed:
+            print(f"Webinar changes picked up: {changed} reminder jobs added, moved or cancelled")
+        return changed
+
+    def reconcile(self, webinars):
+        upcoming = {str(w['id']): w for w in webinars}
+        changed = 0
+        scheduled_ids = set()
+        for job in scheduler.get_jobs(jobstore=REMINDER_JOBSTORE):
+            parts = job.id.split(':')
+            if len(parts) != 3:
+                continue
+            if parts[1] in upcoming:
+                scheduled_ids.add(parts[1])
+            else:
+                cancel_reminder_job(job, "webinar removed or no longer upcoming")
+                changed += 1
+        # Attendees of removed and past webinars go with their jobs, so the index only holds upcoming ones
+        pruned = attendees.prune(upcoming)
+        if pruned:
+            print(f"Dropped {pruned} attendee rows of webinars that are no longer upcoming")
+        for webinar_id in scheduled_ids | attendees.webinar_ids(upcoming):
+            changed += schedule_webinar_reminders(upcoming[webinar_id])
+        return changed
+
+webinar_reconciler = WebinarReconciler()
+
+def reconcile_webinars():
+    """Interval job wrapper around webinar_reconciler.poll()."""
+    try:
+        webinar_reconciler.poll()
+    except Exception as e:
+        print(f"Error reconciling webinar reminders: {e}")
+
+def start_webinar_reconciler():
+    scheduler.add_job(reconcile_webinars, 'interval', seconds=WEBINAR_RECONCILE_SECONDS, id='webinar_reconcile',
+                      replace_existing=True, max_instances=1, coalesce=True)
+
+def restore_reminders():
+    """
+    Resume reminders on startup. Jobs persisted in the reminder job store are
+    picked up by the scheduler directly; the full rebuild from Supabase only
+    runs when the store is empty (first start or a deleted database file).
+    """
+    pending = scheduler.get_jobs(jobstore=REMINDER_JOBSTORE)
+    if pending:
+        print(f"✅ Resumed {len(pending)} persisted reminder jobs")
+        return
+    schedule_all_reminders()
+    print("✅ Successfully scheduled all reminders from Supabase")
+
+# APScheduler setup (started by the importing script, see bot.py)
+scheduler = BackgroundScheduler(
+    timezone=timezone.utc,
+    jobstores={
+        'default': MemoryJobStore(),
+        REMINDER_JOBSTORE: SQLAlchemyJobStore(url=REMINDER_JOBSTORE_URL),
+    },
+    job_defaults={'misfire_grace_time': REMINDER_MISFIRE_GRACE_SECONDS, 'coalesce': True},
+)
+
+def run_standalone():
     import time
+    scheduler.start()
+    restore_reminders()
+    start_webinar_reconciler()
     print("Reminder scheduler running. Press Ctrl+C to exit.")
     try:
         while True:
             time.sleep(60)
     except KeyboardInterrupt:
         print("Exiting...")
-        scheduler.shutdown() 
\ No newline at end of file
+        scheduler.shutdown()
+
+# If you want to keep the scheduler running in a standalone script:
+if __name__ == "__main__":
+    # Go through the importable module so there is a single scheduler instance
+    import reminder_scheduler
+    reminder_scheduler.run_standalone()
@@ -1,21 +1,114 @@
 import os
+import time
+import threading
+from collections import OrderedDict
 import requests
 import json
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from google.oauth2 import service_account
+from metrics import SUPABASE_SECONDS, SUPABASE_ERRORS
 
 load_dotenv()
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_API_KEY')
 
-REGISTRATIONS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/registrations"
+# Connection pool size per host; should cover the bot's handler threads plus the schedulers
+SUPABASE_POOL_SIZE = int(os.getenv('SUPABASE_POOL_SIZE', '20'))
+# (connect, read) timeouts in seconds applied to every request unless overridden
+SUPABASE_TIMEOUT = (3.05, 15)
+# Rows per request when streaming whole tables
+SUPABASE_PAGE_SIZE = int(os.getenv('SUPABASE_PAGE_SIZE', '1000'))
+# Webinar ids per registrations request when filtering with webinar_id=in.(...), keeps URLs short
+WEBINAR_ID_BATCH = 100
+# Webinars whose date is up to this far in the past still count as upcoming. Dates may be stored
+# as naive local (Asia/Almaty) times, so comparing them with UTC now needs some slack.
+UPCOMING_WEBINARS_MARGIN = timedelta(days=1)
+# How many known telegram_ids to remember so repeat /start presses skip Supabase
+SEEN_USERS_CACHE_SIZE = int(os.getenv('SEEN_USERS_CACHE_SIZE', '100000'))
 
-HEADERS = {
-    "apikey": SUPABASE_KEY,
-    "Authorization": f"Bearer {SUPABASE_KEY}",
-    "Content-Type": "application/json"
-}
+
+class SupabaseClient:
+    """
+    Thin PostgREST client around a shared requests.Session.
+
+    Connections are kept alive and pooled, so repeated calls reuse the same
+    TCP+TLS connection instead of doing a new handshake each time. Auth headers
+    are built once and every request gets a default timeout.
+    """
+
+    def __init__(self, url=None, api_key=None, pool_size=SUPABASE_POOL_SIZE, timeout=SUPABASE_TIMEOUT):
+        url = url or SUPABASE_URL
+        api_key = api_key or SUPABASE_KEY
+        if not url or not api_key:
+            raise ValueError("Missing SUPABASE_URL or SUPABASE_API_KEY in environment variables.")
+        self.rest_url = f"{url.rstrip('/')}/rest/v1"
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "apikey": api_key,
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        })
+
+    def endpoint(self, table):
+        return f"{self.rest_url}/{table}"
+
+    def request(self, method, table, params=None, json=None, headers=None, timeout=None):
+        """
+        Send a request to /rest/v1/<table> and return the requests.Response.
+        Does not raise on HTTP errors; callers decide how to handle status codes.
+        Latency and failures are recorded per method and table.
+        """
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method,
+                self.endpoint(table),
+                params=params,
+                json=json,
+                headers=headers,
+                timeout=timeout or self.timeout,
+            )
+        except Exception:
+            SUPABASE_ERRORS.inc(method=method, table=table)
+            raise
+        finally:
+            SUPABASE_SECONDS.observe(time.perf_counter() - start, method=method, table=table)
+        if response.status_code >= 400:
+            SUPABASE_ERRORS.inc(method=method, table=table)
+        return response
+
+    def get(self, table, params=None, **kwargs):
+        return self.request('GET', table, params=params, **kwargs)
+
+    def post(self, table, json=None, **kwargs):
+        return self.request('POST', table, json=json, **kwargs)
+
+    def patch(self, table, json=None, params=None, **kwargs):
+        return self.request('PATCH', table, json=json, params=params, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_supabase_client():
+    """
+    Return the process-wide SupabaseClient, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SupabaseClient()
+    return _client
 
 def get_service_account_credentials():
     """
@@ -25,7 +118,7 @@ def get_service_account_credentials():
     service_account_json = os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON')
     if not service_account_json:
         raise ValueError("GOOGLE_SERVICE_ACCOUNT_JSON not found in environment variables")
-    
+
     try:
         # Parse the JSON string from environment variable
         service_account_info = json.loads(service_account_json)
@@ -33,37 +126,86 @@ def get_service_account_credentials():
     except json.JSONDecodeError as e:
         raise ValueError(f"Invalid JSON in GOOGLE_SERVICE_ACCOUNT_JSON: {e}")
 
-def save_registration_to_supabase(user_data, telegram_id, username=None):
-    print("save_registration_to_supabase called with:", user_data, telegram_id)
-    data = {
+class SeenUsers:
+    """
+    Bounded LRU set of telegram_ids known to be in the users table.
+    Thread-safe; the least recently seen ids are dropped once max_entries is reached.
+    """
+
+    def __init__(self, max_entries=SEEN_USERS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._ids = OrderedDict()
+
+    def __contains__(self, telegram_id):
+        key = str(telegram_id)
+        with self._lock:
+            if key not in self._ids:
+                return False
+            self._ids.move_to_end(key)
+            return True
+
+    def add(self, telegram_id):
+        key = str(telegram_id)
+        with self._lock:
+            self._ids[key] = None
+            self._ids.move_to_end(key)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
+
+
+seen_users = SeenUsers()
+
+def warm_seen_users():
+    """
+    Fill seen_users from the users table (streamed, stops once the cache is full).
+    Returns the number of ids loaded.
+    """
+    count = 0
+    for row in iter_rows("users", select="telegram_id"):
+        if count >= seen_users.max_entries:
+            break
+        if row.get("telegram_id"):
+            seen_users.add(row["telegram_id"])
+            count += 1
+    print(f"Loaded {count} known users into the seen-users cache.")
+    return count
+
+# Upsert on the unique telegram_id: inserting an existing user is a no-op instead of a 409
+USER_UPSERT_PARAMS = {"on_conflict": "telegram_id"}
+USER_UPSERT_HEADERS = {"Prefer": "resolution=ignore-duplicates,return=minimal"}
+
+# Makes PostgREST return the written rows in the response body, so the caller
+# gets the new id (or the updated row) without a follow-up query
+RETURN_REPRESENTATION = {"Prefer": "return=representation"}
+
+# Row builders shared by the sync helpers below, async_supabase and registration_outbox.
+# The old one-call helpers were removed on purpose, not ported to the pooled client:
+#   save_registration_to_supabase, save_course_registration_to_supabase
+#       -> registration_outbox.queue_registration / queue_course_registration
+#   fetch_registrations, fetch_course_registrations -> iter_rows (streamed)
+#   get_course_registration_by_id -> the row queue_course_registration returns
+#   check_user_exists -> save_user_to_supabase (an upsert) and the seen-users cache
+def first_row(rows):
+    """First row of a return=representation response body, or None if it is empty."""
+    return rows[0] if rows else None
+
+def build_registration_row(user_data, telegram_id, username=None):
+    return {
         "telegram_id": f"@{username}" if username else str(telegram_id),
         "full_name": user_data.get("full_name"),
         "email": user_data.get("email"),
         "phone": user_data.get("phone"),
         "webinar_date": user_data.get("date"),
     }
-    print("Data to send:", data)
-    print("Endpoint:", REGISTRATIONS_ENDPOINT)
-    print("Headers:", HEADERS)
-    try:
-        response = requests.post(REGISTRATIONS_ENDPOINT, json=data, headers=HEADERS)
-        print("Supabase response:", response.status_code, response.text)
-        if response.status_code in (200, 201):
-            print("Registration saved to Supabase.")
-            return True
-        else:
-            print(f"Failed to save registration: {response.status_code} {response.text}")
-            return False
-    except Exception as e:
-        print(f"Exception during Supabase registration: {e}")
-        return False 
 
-def save_course_registration_to_supabase(user_data, telegram_id, username=None):
+def build_course_registration_row(user_data, telegram_id, username=None):
     """
-    Save course registration to Supabase course_registrations table.
-    Returns True if successful, False otherwise.
-    
-    Required table schema:
+    Row for the course_registrations table:
     CREATE TABLE course_registrations (
       id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
       telegram_id TEXT NOT NULL,
@@ -75,11 +217,7 @@ def save_course_registration_to_supabase(user_data, telegram_id, username=None):
       created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
     );
     """
-    print("save_course_registration_to_supabase called with:", user_data, telegram_id)
-    
-    COURSE_REGISTRATIONS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/course_registrations"
-    
-    data = {
+    return {
         "telegram_id": str(telegram_id),
         "telegram_username": f"@{username}" if username else None,
         "full_name": user_data.get("full_name"),
@@ -87,92 +225,51 @@ def save_course_registration_to_supabase(user_data, telegram_id, username=None):
         "is_paid": False,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    
-    print("Course registration data to send:", data)
-    print("Endpoint:", COURSE_REGISTRATIONS_ENDPOINT)
-    print("Headers:", HEADERS)
-    
-    try:
-        response = requests.post(COURSE_REGISTRATIONS_ENDPOINT, json=data, headers=HEADERS)
-        print("Supabase response:", response.status_code, response.text)
-        
-        if response.status_code in (200, 201):
-            print("Course registration saved to Supabase.")
-            return True
-        else:
-            print(f"Failed to save course registration: {response.status_code} {response.text}")
-            return False
-    except Exception as e:
-        print(f"Exception during Supabase course registration: {e}")
-        return False
+
+def build_payment_update():
+    return {
+        "is_paid": True,
+        "paid_at": datetime.now(timezone.utc).isoformat()
+    }
+
+def build_user_row(telegram_id, username=None):
+    return {
+        "telegram_id": str(telegram_id),
+        "telegram_username": f"@{username}" if username else None,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
 
 def update_course_payment_status(registration_id):
     """
     Update course registration payment status to paid in Supabase.
+    Returns the updated row, or None on failure or if no row has that id.
     """
     print(f"update_course_payment_status called with registration_id: {registration_id}")
-    
-    COURSE_REGISTRATIONS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/course_registrations"
-    
-    data = {
-        "is_paid": True,
-        "paid_at": datetime.now(timezone.utc).isoformat()
-    }
-    
+
+    data = build_payment_update()
+
     print("Payment update data to send:", data)
-    print("Endpoint:", f"{COURSE_REGISTRATIONS_ENDPOINT}?id=eq.{registration_id}")
-    
+
     try:
-        response = requests.patch(
-            f"{COURSE_REGISTRATIONS_ENDPOINT}?id=eq.{registration_id}",
+        response = get_supabase_client().patch(
+            "course_registrations",
             json=data,
-            headers=HEADERS
+            params={"id": f"eq.{registration_id}"},
+            headers=RETURN_REPRESENTATION
         )
         print("Supabase response:", response.status_code, response.text)
-        if response.status_code in (200, 204):
-            print("Course payment status updated in Supabase.")
-            return True
+        if response.status_code == 200:
+            row = first_row(response.json())
+            if row is None:
+                print(f"No course registration with id {registration_id}")
+            else:
+                print("Course payment status updated in Supabase.")
+            return row
         else:
             print(f"Failed to update payment status: {response.status_code} {response.text}")
-            return False
+            return None
     except Exception as e:
         print(f"Exception during payment status update: {e}")
-        return False
-
-def get_course_registration_by_id(registration_id):
-    """
-    Get course registration details by ID from Supabase.
-    """
-    COURSE_REGISTRATIONS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/course_registrations"
-    
-    try:
-        response = requests.get(
-            f"{COURSE_REGISTRATIONS_ENDPOINT}?id=eq.{registration_id}",
-            headers=HEADERS
-        )
-        response.raise_for_status()
-        registrations = response.json()
-        return registrations[0] if registrations else None
-    except Exception as e:
-        print(f"Exception getting course registration: {e}")
-        return None
-
-def get_latest_course_registration_by_telegram_id(telegram_id):
-    """
-    Get the latest course registration for a specific telegram_id from Supabase.
-    """
-    COURSE_REGISTRATIONS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/course_registrations"
-    
-    try:
-        response = requests.get(
-            f"{COURSE_REGISTRATIONS_ENDPOINT}?telegram_id=eq.{telegram_id}&order=created_at.desc&limit=1",
-            headers=HEADERS
-        )
-        response.raise_for_status()
-        registrations = response.json()
-        return registrations[0] if registrations else None
-    except Exception as e:
-        print(f"Exception getting latest course registration: {e}")
         return None
 
 def format_date_to_iso(date_str):
@@ -187,79 +284,96 @@ def get_webinar_dates():
     Fetch all webinar dates from the Supabase 'dates' table.
     Returns a list of dicts with keys: id, date, link.
     """
-    SUPABASE_URL = os.getenv('SUPABASE_URL')
-    SUPABASE_API_KEY = os.getenv('SUPABASE_API_KEY')
-    if not SUPABASE_URL or not SUPABASE_API_KEY:
-        raise ValueError("Missing SUPABASE_URL or SUPABASE_API_KEY in environment variables.")
-    endpoint = f"{SUPABASE_URL}/rest/v1/webinars"
-    headers = {
-        "apikey": SUPABASE_API_KEY,
-        "Authorization": f"Bearer {SUPABASE_API_KEY}",
-    }
-    response = requests.get(endpoint, headers=headers)
+    response = get_supabase_client().get("webinars")
     response.raise_for_status()
     return response.json()
 
-def fetch_registrations():
+def get_upcoming_webinars(now=None):
     """
-    Fetch all registrations from the Supabase 'registrations' table.
-    Returns a list of dicts.
+    Fetch webinars that have not taken place yet (date >= now, minus
+    UPCOMING_WEBINARS_MARGIN), oldest first. Callers still check the exact time.
     """
-    SUPABASE_URL = os.getenv('SUPABASE_URL')
-    SUPABASE_API_KEY = os.getenv('SUPABASE_API_KEY')
-    if not SUPABASE_URL or not SUPABASE_API_KEY:
-        raise ValueError("Missing SUPABASE_URL or SUPABASE_API_KEY in environment variables.")
-    endpoint = f"{SUPABASE_URL}/rest/v1/registrations"
-    headers = {
-        "apikey": SUPABASE_API_KEY,
-        "Authorization": f"Bearer {SUPABASE_API_KEY}",
-    }
-    response = requests.get(endpoint, headers=headers)
+    since = (now or datetime.now(timezone.utc)) - UPCOMING_WEBINARS_MARGIN
+    response = get_supabase_client().get(
+        "webinars",
+        params={"date": f"gte.{since.strftime('%Y-%m-%dT%H:%M:%S')}", "order": "date.asc"},
+    )
     response.raise_for_status()
     return response.json()
 
-def fetch_course_registrations():
+def iter_attendees(webinar_ids, page_size=SUPABASE_PAGE_SIZE):
     """
-    Fetch all course registrations from the Supabase 'course_registrations' table.
-    Returns a list of dicts.
+    Stream the telegram_id and webinar_id of registrations for the given webinars only,
+    filtered server-side with webinar_id=in.(...). An index on registrations(webinar_id)
+    keeps this proportional to upcoming attendance rather than to the whole table.
     """
-    SUPABASE_URL = os.getenv('SUPABASE_URL')
-    SUPABASE_API_KEY = os.getenv('SUPABASE_API_KEY')
-    if not SUPABASE_URL or not SUPABASE_API_KEY:
-        raise ValueError("Missing SUPABASE_URL or SUPABASE_API_KEY in environment variables.")
-    endpoint = f"{SUPABASE_URL}/rest/v1/course_registrations"
-    headers = {
-        "apikey": SUPABASE_API_KEY,
-        "Authorization": f"Bearer {SUPABASE_API_KEY}",
-    }
-    response = requests.get(endpoint, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    webinar_ids = sorted(str(webinar_id) for webinar_id in webinar_ids)
+    for start in range(0, len(webinar_ids), WEBINAR_ID_BATCH):
+        batch = webinar_ids[start:start + WEBINAR_ID_BATCH]
+        yield from iter_rows(
+            "registrations",
+            select="telegram_id,webinar_id",
+            filters={"webinar_id": f"in.({','.join(batch)})"},
+            page_size=page_size,
+        )
 
-def check_user_exists(telegram_id):
+def iter_rows(table, select="*", filters=None, page_size=SUPABASE_PAGE_SIZE):
     """
-    Check if a telegram_id already exists in the users table.
-    Returns True if user exists, False otherwise.
+    Stream all rows of a table page by page, ordered by id (keyset pagination).
+    Unlike a single GET this is not silently cut off at PostgREST's max-rows limit.
+    select is a PostgREST column list (id is always included for paging) and
+    filters is a dict of extra query params, e.g. {"webinar_id": "eq.3"}.
     """
-    USERS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/users"
-    
-    try:
-        response = requests.get(
-            f"{USERS_ENDPOINT}?telegram_id=eq.{telegram_id}",
-            headers=HEADERS
+    if select != "*" and "id" not in select.split(","):
+        select = f"id,{select}"
+    client = get_supabase_client()
+    last_id = None
+    while True:
+        params = dict(filters or {})
+        params.update({"select": select, "order": "id.asc", "limit": page_size})
+        if last_id is not None:
+            params["id"] = f"gt.{last_id}"
+        response = client.get(table, params=params)
+        response.raise_for_status()
+        page = response.json()
+        # The server may cap pages below page_size, so only an empty page means we are done
+        if not page:
+            return
+        yield from page
+        last_id = page[-1]["id"]
+
+def iter_rows_since(table, cursor, page_size=SUPABASE_PAGE_SIZE):
+    """
+    Stream rows of a table created after the given cursor, oldest first.
+    cursor is a dict with keys created_at and id (the last row already seen);
+    ties on created_at are broken by id so no row is skipped or repeated.
+    """
+    client = get_supabase_client()
+    created_at, row_id = cursor['created_at'], cursor['id']
+    while True:
+        response = client.get(
+            table,
+            params={
+                "or": f'(created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt."{row_id}"))',
+                "order": "created_at.asc,id.asc",
+                "limit": page_size,
+            }
         )
         response.raise_for_status()
-        users = response.json()
-        return len(users) > 0
-    except Exception as e:
-        print(f"Exception checking if user exists: {e}")
-        return False
+        page = response.json()
+        if not page:
+            return
+        yield from page
+        created_at, row_id = page[-1]['created_at'], page[-1]['id']
 
 def save_user_to_supabase(telegram_id, username=None):
     """
     Save a unique user to the users table in Supabase.
     Returns True if successful, False otherwise.
-    
+
+    Users already in seen_users cost no request at all; anyone else gets a
+    single idempotent upsert, so double taps on /start can't race.
+
     Required table schema:
     CREATE TABLE users (
       id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
@@ -268,35 +382,24 @@ def save_user_to_supabase(telegram_id, username=None):
       created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
     );
     """
-    print(f"save_user_to_supabase called with telegram_id: {telegram_id}, username: {username}")
-    
-    # First check if user already exists
-    if check_user_exists(telegram_id):
-        print(f"User with telegram_id {telegram_id} already exists, skipping save.")
+    if telegram_id in seen_users:
         return True
-    
-    USERS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/users"
-    
-    data = {
-        "telegram_id": str(telegram_id),
-        "telegram_username": f"@{username}" if username else None,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    
+
+    data = build_user_row(telegram_id, username)
+
     print("User data to send:", data)
-    print("Endpoint:", USERS_ENDPOINT)
-    print("Headers:", HEADERS)
-    
+
     try:
-        response = requests.post(USERS_ENDPOINT, json=data, headers=HEADERS)
+        response = get_supabase_client().post("users", json=data, params=USER_UPSERT_PARAMS, headers=USER_UPSERT_HEADERS)
         print("Supabase response:", response.status_code, response.text)
-        
-        if response.status_code in (200, 201):
+
+        if response.status_code in (200, 201, 204):
             print("User saved to Supabase.")
+            seen_users.add(telegram_id)
             return True
         else:
             print(f"Failed to save user: {response.status_code} {response.text}")
             return False
     except Exception as e:
         print(f"Exception during Supabase user save: {e}")
-        return False
\ No newline at end of file
+        return False
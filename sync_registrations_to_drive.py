@@ -1,29 +1,78 @@
 import os
 import io
-import requests
-import pandas as pd
+import time
+import json
+import hashlib
+import functools
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pytz
+from dateutil import parser
+from openpyxl import Workbook, load_workbook
 from dotenv import load_dotenv
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
-from supabase_utils import fetch_registrations, get_service_account_credentials
-from apscheduler.schedulers.background import BackgroundScheduler
-import time
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
+from supabase_utils import iter_rows, iter_rows_since, get_service_account_credentials
+from local_state import local_state
+from metrics import timed, DRIVE_SECONDS, DRIVE_ERRORS, DRIVE_SYNCS
 
 # Load environment variables
 load_dotenv()
-SUPABASE_URL = os.getenv('SUPABASE_URL')
-SUPABASE_API_KEY = os.getenv('SUPABASE_API_KEY')
 GOOGLE_DRIVE_FOLDER_ID = os.getenv('GOOGLE_DRIVE_FOLDER_ID')
 EXCEL_FILE_NAME = 'WebinarRegistrations.xlsx'  # Fixed file name
+EXCEL_FILE_NAME_COURSES = 'CoursesRegistrations.xlsx'
+XLSX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 
 # Easily editable sync interval (in minutes)
 SYNC_INTERVAL_MINUTES = 30
+# Between full rewrites only rows newer than the stored cursor are appended.
+# A full rewrite also picks up edits to old rows (e.g. course payments) and anything the delta missed.
+FULL_RECONCILE_HOURS = int(os.getenv('DRIVE_FULL_RECONCILE_HOURS', '24'))
+# The export rewrites the workbook with Sheet1 only; set to keep any other sheets someone added by hand
+PRESERVE_OTHER_SHEETS = os.getenv('DRIVE_PRESERVE_SHEETS', '').lower() in ('1', 'true', 'yes')
+
+# Sheet1 column order; keys not listed here are added after them
+REGISTRATION_COLUMNS = ('id', 'created_at', 'telegram_id', 'full_name', 'email', 'phone', 'webinar_date', 'webinar_id')
+COURSE_REGISTRATION_COLUMNS = (
+    'id', 'created_at', 'telegram_id', 'telegram_username', 'full_name', 'phone', 'is_paid', 'paid_at',
+)
+# Written as Excel dates (in EXPORT_TIMEZONE) rather than ISO strings
+DATE_COLUMNS = {'created_at', 'paid_at', 'webinar_date'}
+EXPORT_TIMEZONE = pytz.timezone(os.getenv('EXPORT_TIMEZONE', 'Asia/Almaty'))
+# Columns that identify a row and change when it is edited; a full sync is skipped when their digest is unchanged
+DIGEST_COLUMNS = {
+    'registrations': ('id', 'created_at'),
+    'course_registrations': ('id', 'created_at', 'is_paid', 'paid_at'),
+}
+
+# Google Drive API setup. Credentials are parsed once per process (google-auth refreshes
+# the access token itself); clients are per thread because httplib2 is not thread-safe.
+_drive_credentials = None
+_drive_credentials_lock = threading.Lock()
+_drive_clients = threading.local()
+
+def get_drive_credentials():
+    global _drive_credentials
+    with _drive_credentials_lock:
+        if _drive_credentials is None:
+            _drive_credentials = get_service_account_credentials()
+        return _drive_credentials
 
-# Google Drive API setup
 def get_drive_service():
-    creds = get_service_account_credentials()
-    return build('drive', 'v3', credentials=creds)
+    """
+    Drive client for the calling thread, built on first use and reused by later syncs.
+    Uses the discovery document bundled with google-api-python-client instead of fetching it.
+    """
+    service = getattr(_drive_clients, 'service', None)
+    if service is None:
+        service = build('drive', 'v3', credentials=get_drive_credentials(), static_discovery=True, cache_discovery=False)
+        _drive_clients.service = service
+    return service
 
+@timed(DRIVE_SECONDS, DRIVE_ERRORS, call='find_file')
 def find_file_metadata(service, folder_id, file_name):
     query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
     results = service.files().list(q=query, fields="files(id, name, mimeType)").execute()
@@ -32,31 +81,185 @@ def find_file_metadata(service, folder_id, file_name):
         raise FileNotFoundError(f"File '{file_name}' not found in folder '{folder_id}'")
     return files[0]  # returns dict with id, name, mimeType
 
-def download_excel_file(service, file_id, mime_type, local_path):
+def drive_file_key(folder_id, file_name):
+    return f"drive_file:{folder_id}:{file_name}"
+
+def resolve_drive_file(service, folder_id, file_name):
+    """
+    Metadata (id, mimeType) of a file in the folder, from the local cache when known.
+    Only searches Drive on a cache miss; raises FileNotFoundError if there is no such file.
+    """
+    metadata = local_state.get(drive_file_key(folder_id, file_name))
+    if metadata is None:
+        metadata = find_file_metadata(service, folder_id, file_name)
+        remember_drive_file(folder_id, file_name, metadata['id'], metadata['mimeType'])
+    return metadata
+
+def remember_drive_file(folder_id, file_name, file_id, mime_type):
+    local_state.set(drive_file_key(folder_id, file_name), {'id': file_id, 'mimeType': mime_type})
+
+def with_drive_file(service, folder_id, file_name, action):
+    """
+    Call action(metadata) for the cached file. A 404 means the cached id is stale
+    (file deleted or replaced), so the entry is dropped, the file looked up again
+    and action retried once.
+    """
+    metadata = resolve_drive_file(service, folder_id, file_name)
+    try:
+        return action(metadata)
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+        print(f"Cached Drive id for '{file_name}' is gone, looking the file up again")
+        local_state.delete(drive_file_key(folder_id, file_name))
+        return action(resolve_drive_file(service, folder_id, file_name))
+
+@timed(DRIVE_SECONDS, DRIVE_ERRORS, call='download')
+def download_excel_file(service, file_id, mime_type):
+    """Download the file into memory. Returns a BytesIO positioned at the start."""
     if mime_type == 'application/vnd.google-apps.spreadsheet':
         # Export Google Sheet as Excel
-        request = service.files().export_media(fileId=file_id, mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        request = service.files().export_media(fileId=file_id, mimeType=XLSX_MIME_TYPE)
     else:
         # Download native Excel file
         request = service.files().get_media(fileId=file_id)
-    fh = io.FileIO(local_path, 'wb')
-    downloader = MediaIoBaseDownload(fh, request)
+    buffer = io.BytesIO()
+    downloader = MediaIoBaseDownload(buffer, request)
     done = False
     while not done:
         status, done = downloader.next_chunk()
-    fh.close()
+    buffer.seek(0)
+    return buffer
+
+def parse_export_datetime(text):
+    """
+    Parse an ISO timestamp from Supabase into a naive datetime Excel can store
+    as a date. Aware values are shown in EXPORT_TIMEZONE; unparseable text is kept.
+    """
+    try:
+        dt = datetime.fromisoformat(text)
+    except ValueError:
+        try:
+            dt = parser.isoparse(text)
+        except ValueError:
+            return text
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(EXPORT_TIMEZONE).replace(tzinfo=None)
+    return dt
+
+def excel_value(column, value):
+    if isinstance(value, str) and column in DATE_COLUMNS:
+        return parse_export_datetime(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
 
-def update_excel_sheet(local_path, registrations):
-    # Load Excel file
-    with pd.ExcelWriter(local_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-        df = pd.DataFrame(registrations)
-        df.to_excel(writer, sheet_name='Sheet1', index=False)
-    # openpyxl preserves other sheets/styles
+def write_sheet(ws, rows, columns=(), existing_rows=()):
+    """
+    Stream a sheet into a write-only worksheet: the header, then existing_rows
+    (value tuples already in header order, e.g. copied from the old file), then
+    the dict rows. Columns are the given ones in order, followed by any other keys
+    of the first new row. Returns the number of new rows written.
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    columns = list(columns) + [key for key in (first or {}) if key not in columns]
+    ws.append(columns)
+    for values in existing_rows:
+        ws.append(values)
+    if first is None:
+        return 0
+    count = 0
+    for row in itertools.chain([first], rows):
+        ws.append([excel_value(column, row.get(column)) for column in columns])
+        count += 1
+    return count
 
-def upload_excel_file(service, file_id, local_path, mime_type):
+def copy_sheet(source, target):
+    """Copy cell values (not formatting) from a read-only worksheet into a write-only one."""
+    for values in source.iter_rows(values_only=True):
+        target.append(values)
+
+def stream_workbook(output, fill_sheet1, source=None, preserve_sheets=False):
+    """
+    Write a new workbook to output (a path or a binary file object such as
+    BytesIO) in write-only mode, so memory stays flat however many rows there
+    are. fill_sheet1(ws) writes Sheet1 and returns its row count. With
+    preserve_sheets the other sheets of source (a read-only workbook) are copied
+    over by value, in their original order; otherwise the file contains Sheet1
+    only. Returns fill_sheet1's count.
+    """
+    wb = Workbook(write_only=True)
+    count = None
+    for name in (source.sheetnames if source is not None else []):
+        if name == 'Sheet1':
+            count = fill_sheet1(wb.create_sheet('Sheet1'))
+        elif preserve_sheets:
+            copy_sheet(source[name], wb.create_sheet(name))
+    if count is None:
+        count = fill_sheet1(wb.create_sheet('Sheet1', 0))
+    if not isinstance(output, str):
+        wb.save(output)
+        return count
+    # The source may be the file being replaced, so write next to it and swap
+    temp_path = f"{output}.tmp"
+    wb.save(temp_path)
+    os.replace(temp_path, output)
+    return count
+
+def update_excel_sheet(output, registrations, columns=(), preserve_sheets=False, existing=None):
+    """
+    Write a workbook whose Sheet1 holds the given rows (any iterable of dicts).
+    With preserve_sheets the other sheets of existing (path or file object;
+    defaults to output when that is a path) are kept. Returns the number of rows written.
+    """
+    if existing is None and isinstance(output, str) and os.path.exists(output):
+        existing = output
+    fill = lambda ws: write_sheet(ws, registrations, columns)
+    if not preserve_sheets or existing is None:
+        return stream_workbook(output, fill)
+    source = load_workbook(existing, read_only=True)
+    try:
+        return stream_workbook(output, fill, source, preserve_sheets=True)
+    finally:
+        source.close()
+
+def append_rows_to_sheet(output, rows, columns=(), preserve_sheets=False, existing=None):
+    """
+    Write existing (path or file object; defaults to output) to output with rows
+    appended to Sheet1, streaming the old file through instead of loading it.
+    Columns missing from the existing header are added at the end.
+    Returns the number of rows appended.
+    """
+    source = load_workbook(output if existing is None else existing, read_only=True)
+    try:
+        old_rows = source['Sheet1'].iter_rows(values_only=True) if 'Sheet1' in source.sheetnames else iter(())
+        header = list(next(old_rows, None) or [])
+        while header and header[-1] is None:
+            header.pop()
+        header += [column for column in columns if column not in header]
+        fill = lambda ws: write_sheet(ws, rows, header, old_rows)
+        return stream_workbook(output, fill, source, preserve_sheets)
+    finally:
+        source.close()
+
+def create_excel_file(output, rows, columns=()):
+    """
+    Write rows to a new workbook with a single Sheet1 (output is a path or file object).
+    Returns the number of rows written.
+    """
+    return stream_workbook(output, lambda ws: write_sheet(ws, rows, columns))
+
+def excel_media(buffer):
+    buffer.seek(0)
+    return MediaIoBaseUpload(buffer, mimetype=XLSX_MIME_TYPE)
+
+@timed(DRIVE_SECONDS, DRIVE_ERRORS, call='upload')
+def upload_excel_file(service, file_id, buffer, mime_type):
+    """Replace the file's content with the workbook in buffer (a BytesIO)."""
+    media = excel_media(buffer)
     if mime_type == 'application/vnd.google-apps.spreadsheet':
         # Re-upload as Google Sheet (convert Excel to Google Sheet)
-        media = MediaFileUpload(local_path, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
         updated = service.files().update(
             fileId=file_id,
             media_body=media,
@@ -64,40 +267,322 @@ def upload_excel_file(service, file_id, local_path, mime_type):
         ).execute()
     else:
         # Replace Excel file
-        media = MediaFileUpload(local_path, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
         updated = service.files().update(fileId=file_id, media_body=media).execute()
     return updated
 
-def main():
+@timed(DRIVE_SECONDS, DRIVE_ERRORS, call='create')
+def create_drive_file(service, folder_id, file_name, buffer):
+    """Upload the workbook in buffer as a new Excel file in the folder. Returns the new file id."""
+    file_metadata = {
+        'name': file_name,
+        'parents': [folder_id]
+    }
+    media = excel_media(buffer)
+    file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+    return file.get('id')
+
+class RowDigest:
+    """
+    Order-independent fingerprint of a table: the row count plus the sum of a
+    hash of each row's digest columns. Rows appended by a delta sync can be
+    added to a stored value, and scanning just those columns of the whole table
+    reproduces it, so "nothing changed" is cheap to detect.
+    """
+
+    MODULUS = 2 ** 128
+
+    def __init__(self, columns, value=None):
+        self.columns = columns
+        self.count = 0
+        self.total = 0
+        if value:
+            count, total = value.split(':')
+            self.count, self.total = int(count), int(total, 16)
+
+    def add(self, row):
+        key = '\x1f'.join(str(row.get(column)) for column in self.columns)
+        self.count += 1
+        self.total = (self.total + int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:16], 'big')) % self.MODULUS
+
+    @property
+    def value(self):
+        return f"{self.count}:{self.total:032x}"
+
+def table_digest(table):
+    """Digest of the whole table, fetching only its digest columns."""
+    columns = DIGEST_COLUMNS[table]
+    digest = RowDigest(columns)
+    for row in iter_rows(table, select=','.join(columns)):
+        digest.add(row)
+    return digest.value
+
+def cursor_key(cursor, like_id):
+    """
+    (created_at, id) of a stored cursor, comparable with a row whose id is like_id.
+    Cursors saved by older versions hold integer ids as strings.
+    """
+    row_id = cursor['id']
+    if isinstance(like_id, int) and isinstance(row_id, str) and row_id.lstrip('-').isdigit():
+        row_id = int(row_id)
+    return cursor['created_at'], row_id
+
+class CursorTracker:
+    """
+    Pass-through iterator that records the (created_at, id) high-water mark
+    of the rows flowing through it, so rows can be streamed straight into the
+    workbook without keeping them around to compute the new cursor.
+    Rows are also added to digest (a RowDigest) when one is given.
+    """
+
+    def __init__(self, rows, cursor=None, digest=None):
+        self._rows = rows
+        self.cursor = cursor
+        self.digest = digest
+
+    def __iter__(self):
+        for row in self._rows:
+            if row.get('created_at') is not None and row.get('id') is not None:
+                # ids keep their own type, so integer ids compare as numbers, like the server's id order
+                key = (row['created_at'], row['id'])
+                if self.cursor is None or key > cursor_key(self.cursor, row['id']):
+                    self.cursor = {'created_at': row['created_at'], 'id': row['id']}
+            if self.digest is not None:
+                self.digest.add(row)
+            yield row
+
+# One lock per exported table: a sync triggered while the same table is still
+# syncing (interval job vs /test_sync) is skipped instead of racing it
+SYNC_LOCKS = {table: threading.Lock() for table in DIGEST_COLUMNS}
+
+def exclusive_sync(table):
+    """
+    Run the decorated sync only if no other sync of table is running.
+    The sync returns its outcome ('full', 'delta', 'skipped' or 'failed');
+    a trigger that finds the table busy returns 'busy'.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            lock = SYNC_LOCKS[table]
+            if not lock.acquire(blocking=False):
+                print(f"⏳ Sync of {table} is already running, skipping this trigger.")
+                return 'busy'
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                lock.release()
+        return wrapper
+    return decorator
+
+def plan_sync(table):
+    """
+    Decide between a delta and a full sync for a table.
+    Returns (state, full) where state is the persisted sync state dict.
+    """
+    state = local_state.get(f"drive_sync:{table}", {})
+    last_full = state.get('last_full', 0)
+    full = state.get('cursor') is None or time.time() - last_full >= FULL_RECONCILE_HOURS * 3600
+    return state, full
+
+def fetch_sync_rows(table, state, full):
+    """
+    Return a CursorTracker over the rows to sync, or None if a delta sync has nothing new.
+    """
+    if full:
+        return CursorTracker(iter_rows(table), digest=RowDigest(DIGEST_COLUMNS[table]))
+    rows = iter_rows_since(table, state['cursor'])
+    first = next(rows, None)
+    if first is None:
+        return None
+    # Extend the digest of the last export; without one it stays unknown until the next full sync
+    digest = RowDigest(DIGEST_COLUMNS[table], state['digest']) if state.get('digest') else None
+    return CursorTracker(itertools.chain([first], rows), state['cursor'], digest)
+
+def skip_unchanged(table, state, file_name):
+    """
+    For a full sync: True if the table still has the digest of the last export
+    (and the Drive file is known), in which case the reconcile is recorded as
+    done without downloading, rewriting or uploading anything.
+    """
+    if not state.get('digest') or local_state.get(drive_file_key(GOOGLE_DRIVE_FOLDER_ID, file_name)) is None:
+        return False
+    if table_digest(table) != state['digest']:
+        return False
+    state = dict(state)
+    state['last_full'] = time.time()
+    local_state.set(f"drive_sync:{table}", state)
+    return True
+
+def needs_download(full):
+    """
+    A full rewrite replaces Sheet1 from Supabase, so the current file is only
+    needed for a delta append or to carry over other sheets.
+    """
+    return not full or PRESERVE_OTHER_SHEETS
+
+def save_sync_state(table, state, tracker, full):
+    state = dict(state)
+    state['cursor'] = tracker.cursor
+    state['digest'] = tracker.digest.value if tracker.digest is not None else None
+    if full:
+        state['last_full'] = time.time()
+    local_state.set(f"drive_sync:{table}", state)
+
+@exclusive_sync('course_registrations')
+def sync_course_registrations_to_drive():
+    """Sync course registrations to Google Drive Excel file"""
     try:
-        # 1. Fetch registrations from Supabase
-        registrations = fetch_registrations()
-        # 2. Authenticate and find file in Drive
+        state, full = plan_sync('course_registrations')
+        if full and skip_unchanged('course_registrations', state, EXCEL_FILE_NAME_COURSES):
+            DRIVE_SYNCS.inc(table='course_registrations', result='skipped')
+            print("✅ Course registrations unchanged since last sync, nothing to upload.")
+            return 'skipped'
+        # 1. Check Supabase for course registrations (only new rows between full reconciles)
+        course_registrations = fetch_sync_rows('course_registrations', state, full)
+        if course_registrations is None:
+            DRIVE_SYNCS.inc(table='course_registrations', result='skipped')
+            print("✅ No new course registrations since last sync.")
+            return 'skipped'
+        # 2. Authenticate and find file in Drive (file id is cached across runs)
         service = get_drive_service()
-        file_metadata = find_file_metadata(service, GOOGLE_DRIVE_FOLDER_ID, EXCEL_FILE_NAME)
-        file_id = file_metadata['id']
-        mime_type = file_metadata['mimeType']
-        # 3. Download the file (export if Google Sheet)
-        local_path = EXCEL_FILE_NAME
-        download_excel_file(service, file_id, mime_type, local_path)
-        # 4. Update Sheet1
-        update_excel_sheet(local_path, registrations)
+        folder_id = GOOGLE_DRIVE_FOLDER_ID
+        existing = None
+
+        try:
+            if needs_download(full):
+                # 3. Download the file (export if Google Sheet)
+                existing = with_drive_file(service, folder_id, EXCEL_FILE_NAME_COURSES,
+                                           lambda m: download_excel_file(service, m['id'], m['mimeType']))
+            else:
+                resolve_drive_file(service, folder_id, EXCEL_FILE_NAME_COURSES)
+        except FileNotFoundError:
+            print("📝 Creating new CoursesRegistrations.xlsx file in Google Drive...")
+            if not full:
+                # A new file has to start with the whole table, not just the delta
+                full = True
+                course_registrations = fetch_sync_rows('course_registrations', state, full)
+            # Create a new Excel file with course registrations data
+            workbook = io.BytesIO()
+            create_excel_file(workbook, course_registrations, COURSE_REGISTRATION_COLUMNS)
+
+            # Upload the new file to Google Drive
+            file_id = create_drive_file(service, folder_id, EXCEL_FILE_NAME_COURSES, workbook)
+            remember_drive_file(folder_id, EXCEL_FILE_NAME_COURSES, file_id, XLSX_MIME_TYPE)
+            save_sync_state('course_registrations', state, course_registrations, full)
+            DRIVE_SYNCS.inc(table='course_registrations', result='full')
+            print(f"✅ Created new file with ID: {file_id}")
+            return 'full'
+
+        # 4. Rewrite Sheet1 on a full sync, otherwise append the new rows (streamed page by page)
+        workbook = io.BytesIO()
+        if full:
+            count = update_excel_sheet(workbook, course_registrations, COURSE_REGISTRATION_COLUMNS, PRESERVE_OTHER_SHEETS, existing)
+        else:
+            count = append_rows_to_sheet(workbook, course_registrations, COURSE_REGISTRATION_COLUMNS, PRESERVE_OTHER_SHEETS, existing)
+        # 5. Upload back to Drive (replace original, convert if needed)
+        with_drive_file(service, folder_id, EXCEL_FILE_NAME_COURSES,
+                        lambda m: upload_excel_file(service, m['id'], workbook, m['mimeType']))
+        save_sync_state('course_registrations', state, course_registrations, full)
+        DRIVE_SYNCS.inc(table='course_registrations', result='full' if full else 'delta')
+        print(f"✅ Successfully synced {count} course registrations ({'full' if full else 'delta'}) to '{EXCEL_FILE_NAME_COURSES}' in Google Drive.")
+        return 'full' if full else 'delta'
+    except Exception as e:
+        print(f"❌ Error syncing course registrations to Google Drive: {e}")
+        return 'failed'
+
+@exclusive_sync('registrations')
+def sync_registrations_to_drive():
+    """Sync webinar registrations to Google Drive Excel file"""
+    try:
+        state, full = plan_sync('registrations')
+        if full and skip_unchanged('registrations', state, EXCEL_FILE_NAME):
+            DRIVE_SYNCS.inc(table='registrations', result='skipped')
+            print("✅ Registrations unchanged since last sync, nothing to upload.")
+            return 'skipped'
+        # 1. Check Supabase for registrations (only new rows between full reconciles)
+        registrations = fetch_sync_rows('registrations', state, full)
+        if registrations is None:
+            DRIVE_SYNCS.inc(table='registrations', result='skipped')
+            print("✅ No new registrations since last sync.")
+            return 'skipped'
+        # 2. Authenticate and find file in Drive (file id is cached across runs)
+        service = get_drive_service()
+        folder_id = GOOGLE_DRIVE_FOLDER_ID
+        existing = None
+        if needs_download(full):
+            # 3. Download the file (export if Google Sheet)
+            existing = with_drive_file(service, folder_id, EXCEL_FILE_NAME,
+                                       lambda m: download_excel_file(service, m['id'], m['mimeType']))
+        # 4. Rewrite Sheet1 on a full sync, otherwise append the new rows (streamed page by page)
+        workbook = io.BytesIO()
+        if full:
+            count = update_excel_sheet(workbook, registrations, REGISTRATION_COLUMNS, PRESERVE_OTHER_SHEETS, existing)
+        else:
+            count = append_rows_to_sheet(workbook, registrations, REGISTRATION_COLUMNS, PRESERVE_OTHER_SHEETS, existing)
         # 5. Upload back to Drive (replace original, convert if needed)
-        upload_excel_file(service, file_id, local_path, mime_type)
-        print(f"Successfully updated '{EXCEL_FILE_NAME}' in Google Drive.")
+        with_drive_file(service, folder_id, EXCEL_FILE_NAME,
+                        lambda m: upload_excel_file(service, m['id'], workbook, m['mimeType']))
+        save_sync_state('registrations', state, registrations, full)
+        DRIVE_SYNCS.inc(table='registrations', result='full' if full else 'delta')
+        print(f"✅ Successfully synced {count} registrations ({'full' if full else 'delta'}) to '{EXCEL_FILE_NAME}' in Google Drive.")
+        return 'full' if full else 'delta'
     except Exception as e:
-        print(f"Error: {e}")
+        print(f"❌ Error syncing to Google Drive: {e}")
+        return 'failed'
+
+# Lives as long as the process, so its threads (and their Drive clients) are reused by every run
+_sync_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='drive-sync')
+
+def sync_all_to_drive():
+    """
+    Sync both webinar and course registrations to Google Drive, concurrently.
+    Returns {table: outcome} (see exclusive_sync).
+    """
+    print("🔄 Starting sync of all registrations to Google Drive...")
+    # Each sync reports its own errors; they share nothing but the thread-safe local_state
+    futures = {
+        'registrations': _sync_pool.submit(sync_registrations_to_drive),
+        'course_registrations': _sync_pool.submit(sync_course_registrations_to_drive),
+    }
+    results = {table: future.result() for table, future in futures.items()}
+    print("✅ All sync operations completed.")
+    return results
+
+# Outcome of a sync (see exclusive_sync) as shown to the admin by the manual sync commands
+SYNC_OUTCOME_TEXT = {
+    'full': '✅ full rewrite uploaded',
+    'delta': '✅ new rows appended',
+    'skipped': '✅ nothing to upload',
+    'failed': '❌ failed, see the logs',
+    'busy': '⏳ skipped, another sync of this table was running',
+}
+
+def sync_report(results):
+    return '\n'.join(f"{table}: {SYNC_OUTCOME_TEXT.get(outcome, outcome)}" for table, outcome in results.items())
 
-# Set up scheduler to run sync every SYNC_INTERVAL_MINUTES
-scheduler = BackgroundScheduler()
-scheduler.add_job(main, 'interval', minutes=SYNC_INTERVAL_MINUTES)
-scheduler.start()
+def force_full_sync():
+    """
+    Make the next sync of both tables a full rewrite instead of a delta append.
+    Waits for a sync that is already running, so it cannot write the old state back afterwards.
+    """
+    for table in ('registrations', 'course_registrations'):
+        with SYNC_LOCKS[table]:
+            state = local_state.get(f"drive_sync:{table}", {})
+            state['last_full'] = 0
+            # A manual sync always rewrites, even if the data looks unchanged
+            state['digest'] = None
+            local_state.set(f"drive_sync:{table}", state)
 
 if __name__ == "__main__":
+    from apscheduler.schedulers.background import BackgroundScheduler
+    # Set up scheduler to run sync every SYNC_INTERVAL_MINUTES
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(sync_all_to_drive, 'interval', minutes=SYNC_INTERVAL_MINUTES, max_instances=1, coalesce=True)
+    scheduler.start()
     print(f"Starting sync service. Will sync every {SYNC_INTERVAL_MINUTES} minutes.")
     print("Press Ctrl+C to stop.")
     # Run initial sync
-    main()
+    sync_all_to_drive()
     try:
         while True:
             time.sleep(60)
@@ -107,6 +592,6 @@ if __name__ == "__main__":
     print("\n--- CREDENTIALS & IDS REQUIRED ---")
     print("1. SUPABASE_URL and SUPABASE_API_KEY in your .env")
     print("2. GOOGLE_DRIVE_FOLDER_ID in your .env (the folder containing the Excel file)")
-    print("3. GOOGLE_SERVICE_ACCOUNT_FILE in your .env (path to your Google service account JSON)")
+    print("3. GOOGLE_SERVICE_ACCOUNT_JSON in your .env (contents of your Google service account JSON)")
     print(f"4. The Excel file in Drive must be named exactly: {EXCEL_FILE_NAME}")
-    print(f"5. Sync interval: {SYNC_INTERVAL_MINUTES} minutes (editable in SYNC_INTERVAL_MINUTES constant)") 
\ No newline at end of file
+    print(f"5. Sync interval: {SYNC_INTERVAL_MINUTES} minutes (editable in SYNC_INTERVAL_MINUTES constant)")
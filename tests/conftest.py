@@ -0,0 +1,67 @@
+"""
+Shared setup for the unit tests.
+
+The bot modules read their configuration when they are imported, so the
+environment is pointed at a temporary directory and at a FakePostgREST
+(see benchmarks/fake_services.py) here, before any test imports them.
+
+    python -m pytest -q
+"""
+import os
+import sys
+import shutil
+import atexit
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_services import FakePostgREST
+
+WORKDIR = tempfile.mkdtemp(prefix='bot-tests-')
+atexit.register(shutil.rmtree, WORKDIR, True)
+
+SUPABASE = FakePostgREST().start()
+
+os.environ.update({
+    'TELEGRAM_BOT_TOKEN': '123456:test',
+    'SUPABASE_URL': SUPABASE.url,
+    'SUPABASE_API_KEY': 'test',
+    'LOCAL_STATE_DB': os.path.join(WORKDIR, 'bot_state.sqlite'),
+    'REMINDER_DB_PATH': os.path.join(WORKDIR, 'reminders.sqlite'),
+    'CONVERSATION_STORE': 'memory',
+    'METRICS_PORT': '0',
+})
+
+
+@pytest.fixture
+def supabase():
+    """The FakePostgREST every Supabase call goes to, emptied after each test."""
+    yield SUPABASE
+    SUPABASE.reset()
+
+
+class FakeClock:
+    """Stand-in for the time module with a clock the test moves by hand."""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+
+import pytest
+
+import conversation_state
+from conversation_state import MemoryConversationStore, SQLiteConversationStore, routes_to_step, step_accepts
+
+TTL = 3600
+
+
+@pytest.fixture
+def fake_time(clock, monkeypatch):
+    monkeypatch.setattr(conversation_state, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, fake_time, tmp_path):
+    if request.param == 'memory':
+        return MemoryConversationStore(ttl_seconds=TTL, max_entries=3)
+    return SQLiteConversationStore(str(tmp_path / 'conversations.sqlite'), ttl_seconds=TTL, max_entries=3)
+
+
+def message(chat_id=1, text=None, photo=None):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id), text=text, photo=photo)
+
+
+def test_update_merges_into_the_record(store):
+    store.set(1, {'step': 'name', 'date': 'tomorrow'})
+    assert store.update(1, full_name='Ann', step='email') == {'step': 'email', 'date': 'tomorrow', 'full_name': 'Ann'}
+    assert store.get(1) == {'step': 'email', 'date': 'tomorrow', 'full_name': 'Ann'}
+
+
+def test_returned_records_are_copies(store):
+    store.set(1, {'step': 'name'})
+    store.get(1)['step'] = 'changed'
+    assert store.get(1) == {'step': 'name'}
+
+
+def test_record_expires_after_the_ttl(store, fake_time):
+    store.set(1, {'step': 'name'})
+    fake_time.advance(TTL - 1)
+    assert store.get(1) == {'step': 'name'}
+    fake_time.advance(2)
+    assert store.get(1) is None
+
+
+def test_update_refreshes_the_ttl(store, fake_time):
+    store.set(1, {'step': 'name'})
+    fake_time.advance(TTL - 1)
+    store.update(1, step='email')
+    fake_time.advance(TTL - 1)
+    assert store.get(1) == {'step': 'email'}
+
+
+def test_update_of_an_expired_record_starts_over(store, fake_time):
+    store.set(1, {'step': 'name', 'date': 'tomorrow'})
+    fake_time.advance(TTL + 1)
+    assert store.update(1, step='email') == {'step': 'email'}
+
+
+def test_expired_records_are_pruned_on_write(store, fake_time):
+    store.set(1, {'step': 'name'})
+    store.set(2, {'step': 'name'})
+    fake_time.advance(TTL + 1)
+    store.set(3, {'step': 'name'})
+    assert len(store) == 1
+
+
+def test_memory_store_drops_the_least_recently_updated_over_the_cap(fake_time):
+    store = MemoryConversationStore(ttl_seconds=TTL, max_entries=3)
+    for chat_id in range(1, 5):
+        store.set(chat_id, {'step': 'name'})
+        fake_time.advance(1)
+    assert len(store) == 3
+    assert store.get(1) is None
+    assert store.get(4) == {'step': 'name'}
+
+
+def test_sqlite_store_trims_to_the_cap(fake_time, tmp_path):
+    store = SQLiteConversationStore(str(tmp_path / 'conversations.sqlite'), ttl_seconds=TTL, max_entries=3)
+    for chat_id in range(store.TRIM_EVERY):
+        store.set(chat_id, {'step': 'name'})
+        fake_time.advance(1)
+    assert len(store) == 3
+    assert store.get(store.TRIM_EVERY - 1) == {'step': 'name'}
+
+
+def test_sqlite_store_survives_a_restart(fake_time, tmp_path):
+    path = str(tmp_path / 'conversations.sqlite')
+    SQLiteConversationStore(path, ttl_seconds=TTL).set(1, {'step': 'email', 'full_name': 'Ann'})
+    assert SQLiteConversationStore(path, ttl_seconds=TTL).get(1) == {'step': 'email', 'full_name': 'Ann'}
+
+
+def test_pending_step_takes_messages_but_not_commands(monkeypatch):
+    store = MemoryConversationStore()
+    monkeypatch.setattr(conversation_state, 'conversations', store)
+    store.set(1, {'step': 'name'})
+    assert routes_to_step(message(1, text='Ann'))
+    assert not routes_to_step(message(1, text='/start'))
+    assert not routes_to_step(message(2, text='Ann'))
+
+
+def test_text_steps_refuse_media():
+    assert step_accepts('name', message(text='Ann'))
+    assert not step_accepts('name', message(photo=['receipt']))
+    assert step_accepts('payment_receipt', message(photo=['receipt']))
@@ -0,0 +1,101 @@
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+import outbound_queue
+from outbound_queue import TokenBucket, OutboundQueue
+
+
+@pytest.fixture
+def fake_time(clock, monkeypatch):
+    monkeypatch.setattr(outbound_queue, 'time', clock)
+    return clock
+
+
+def api_error(code):
+    return ApiTelegramException('sendMessage', None, {'error_code': code, 'description': 'test', 'parameters': {'retry_after': 2}})
+
+
+class FakeBot:
+    """Records send_message calls; errors queued in `errors` are raised first."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+def test_token_bucket_allows_a_burst_then_spaces_calls(fake_time):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.5)
+    # Callers already waiting keep their place in line
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_token_bucket_refills_over_time(fake_time):
+    bucket = TokenBucket(rate=1, capacity=2)
+    bucket.reserve()
+    bucket.reserve()
+    assert not bucket.is_idle()
+    fake_time.advance(1)
+    assert bucket.reserve() == 0.0
+    fake_time.advance(2)
+    assert bucket.is_idle()
+
+
+def deliver(queue, chat_id, text, on_sent=None):
+    queue._deliver((chat_id, 'send_message', (text,), {}, on_sent), TokenBucket(1000, 1000))
+
+
+def test_on_sent_is_called_after_a_successful_send(fake_time):
+    bot = FakeBot()
+    queue = OutboundQueue(bot, workers=1, global_rate=1000)
+    sent = []
+    deliver(queue, 1, 'hi', on_sent=lambda: sent.append(1))
+    assert bot.sent == [(1, 'hi')]
+    assert sent == [1]
+    assert queue.stats()['sent'] == 1
+
+
+def test_rate_limit_is_retried_after_the_pause(fake_time):
+    bot = FakeBot([api_error(429)])
+    queue = OutboundQueue(bot, workers=1, global_rate=1000)
+    sent = []
+    deliver(queue, 1, 'hi', on_sent=lambda: sent.append(1))
+    assert bot.sent == [(1, 'hi')]
+    assert sent == [1]
+    assert queue.stats()['rate_limited'] == 1
+
+
+def test_permanent_error_is_not_retried_or_counted_as_sent(fake_time):
+    bot = FakeBot([api_error(403)])
+    queue = OutboundQueue(bot, workers=1, global_rate=1000)
+    sent = []
+    deliver(queue, 1, 'hi', on_sent=lambda: sent.append(1))
+    assert bot.sent == []
+    assert sent == []
+    assert queue.stats()['failed'] == 1
+
+
+def test_call_is_dropped_after_max_retries(fake_time):
+    bot = FakeBot([api_error(502)] * 3)
+    queue = OutboundQueue(bot, workers=1, global_rate=1000, max_retries=2)
+    sent = []
+    deliver(queue, 1, 'hi', on_sent=lambda: sent.append(1))
+    assert bot.sent == []
+    assert sent == []
+    assert queue.stats()['dropped'] == 1
+
+
+def test_messages_to_one_chat_keep_their_order(monkeypatch):
+    monkeypatch.setattr(outbound_queue, 'OUTBOUND_PER_CHAT_RATE', 1000)
+    bot = FakeBot()
+    queue = OutboundQueue(bot, workers=4, global_rate=1000)
+    for i in range(20):
+        queue.send_message(7, str(i))
+    queue.stop()
+    assert [text for _, text in bot.sent] == [str(i) for i in range(20)]
@@ -0,0 +1,150 @@
+import pytest
+
+import registration_outbox
+from registration_outbox import RegistrationOutbox, OUTBOX_MAX_BACKOFF_SECONDS
+
+NOT_NULL_VIOLATION = {'code': '23502', 'message': 'null value in column "full_name" violates not-null constraint'}
+
+
+@pytest.fixture
+def fake_time(clock, monkeypatch):
+    monkeypatch.setattr(registration_outbox, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def outbox(supabase, fake_time, tmp_path):
+    outbox = RegistrationOutbox(str(tmp_path / 'outbox.sqlite'), batch_size=10, write_behind=True)
+    assert outbox.check_schema() == set()
+    return outbox
+
+
+def registration(name):
+    return {'telegram_id': '@' + name, 'full_name': name, 'email': f'{name}@example.com', 'phone': '+77010000000'}
+
+
+def test_flush_writes_rows_with_their_idempotency_keys(outbox, supabase):
+    queued = [outbox.add('registrations', registration(name)) for name in ('ann', 'bob', 'cid')]
+    assert outbox.stats() == {'pending': 3, 'failed': 0}
+    assert outbox.flush() == 3
+    assert outbox.stats() == {'pending': 0, 'failed': 0}
+    rows = supabase.rows('registrations')
+    assert [row['idempotency_key'] for row in rows] == [row['idempotency_key'] for row in queued]
+
+
+def test_sending_a_row_again_does_not_duplicate_it(outbox, supabase):
+    row = outbox.add('registrations', registration('ann'))
+    outbox.flush()
+    # As if Supabase had taken the batch but its answer was lost
+    outbox.add('registrations', row)
+    assert outbox.flush() == 1
+    assert len(supabase.rows('registrations')) == 1
+
+
+def test_course_registration_keeps_its_id(outbox, supabase):
+    row = outbox.add('course_registrations', {'telegram_id': '1', 'full_name': 'Ann', 'phone': '+77010000000'})
+    outbox.flush()
+    assert [r['id'] for r in supabase.rows('course_registrations')] == [row['id']]
+
+
+@pytest.mark.parametrize('status', [503, 429, 401, 403])
+def test_retryable_errors_keep_the_rows_and_back_off(outbox, supabase, fake_time, status):
+    outbox.add('registrations', registration('ann'))
+    supabase.fail(status)
+    assert outbox.flush() == 0
+    assert outbox.stats() == {'pending': 1, 'failed': 0}
+    requests = supabase.requests
+    assert outbox.flush() == 0
+    assert supabase.requests == requests
+    fake_time.advance(2)
+    assert outbox.flush() == 1
+    assert len(supabase.rows('registrations')) == 1
+
+
+def test_backoff_doubles_up_to_the_limit(outbox, supabase, fake_time):
+    outbox.add('registrations', registration('ann'))
+    supabase.fail(503, times=20)
+    delays = []
+    for _ in range(12):
+        outbox.flush()
+        delays.append(outbox._resume_at - fake_time.now)
+        fake_time.advance(delays[-1])
+    assert delays[:4] == [1, 2, 4, 8]
+    assert delays[-1] == OUTBOX_MAX_BACKOFF_SECONDS
+
+
+def test_schema_errors_are_retried_not_rejected(outbox, supabase):
+    outbox.add('registrations', registration('ann'))
+    supabase.fail(400, {'code': 'PGRST204', 'message': 'column not found in the schema cache'})
+    outbox.flush()
+    assert outbox.stats() == {'pending': 1, 'failed': 0}
+
+
+def test_a_bad_row_is_set_aside_and_the_rest_of_its_batch_is_written(outbox, supabase):
+    for name in ('ann', 'bob', 'cid'):
+        outbox.add('registrations', registration(name))
+    # The batch fails, then the first row on its own
+    supabase.fail(400, NOT_NULL_VIOLATION, times=2)
+    assert outbox.flush() == 2
+    assert outbox.stats() == {'pending': 0, 'failed': 1}
+    assert [row['full_name'] for row in supabase.rows('registrations')] == ['bob', 'cid']
+
+    assert outbox.requeue_failed() == 1
+    assert outbox.flush() == 1
+    assert outbox.stats() == {'pending': 0, 'failed': 0}
+
+
+def test_rows_survive_a_restart(supabase, fake_time, tmp_path):
+    path = str(tmp_path / 'outbox.sqlite')
+    RegistrationOutbox(path, write_behind=True).add('registrations', registration('ann'))
+    restarted = RegistrationOutbox(path, write_behind=True)
+    restarted.check_schema()
+    assert restarted.flush() == 1
+    assert len(supabase.rows('registrations')) == 1
+
+
+def test_flush_key_sends_only_that_row(outbox, supabase):
+    outbox.add('course_registrations', {'telegram_id': '1', 'full_name': 'Ann', 'phone': '+7'})
+    row = outbox.add('course_registrations', {'telegram_id': '2', 'full_name': 'Bob', 'phone': '+7'})
+    assert outbox.flush_key(row['id'])
+    assert [r['id'] for r in supabase.rows('course_registrations')] == [row['id']]
+    assert outbox.stats()['pending'] == 1
+    assert outbox.flush_key('not-queued')
+
+
+def test_missing_key_column_falls_back_to_a_plain_insert(supabase, fake_time, tmp_path):
+    supabase.missing_columns['registrations'] = {'idempotency_key'}
+    outbox = RegistrationOutbox(str(tmp_path / 'outbox.sqlite'), write_behind=True)
+    assert outbox.check_schema() == {'registrations'}
+    outbox.add('registrations', registration('ann'))
+    assert outbox.flush() == 1
+    rows = supabase.rows('registrations')
+    assert len(rows) == 1 and 'idempotency_key' not in rows[0]
+
+    # Once the migration has run, the key is sent again
+    supabase.missing_columns.clear()
+    assert outbox.check_schema() == set()
+    outbox.add('registrations', registration('bob'))
+    outbox.flush()
+    assert 'idempotency_key' in supabase.rows('registrations')[-1]
+
+
+def test_undefined_column_on_insert_asks_for_the_schema_again(outbox, supabase):
+    supabase.missing_columns['registrations'] = {'idempotency_key'}
+    outbox.add('registrations', registration('ann'))
+    assert outbox.flush() == 0
+    assert outbox.stats() == {'pending': 1, 'failed': 0}
+    assert outbox.check_schema() == {'registrations'}
+
+
+def test_write_through_sends_before_add_returns(supabase, fake_time, tmp_path):
+    outbox = RegistrationOutbox(str(tmp_path / 'outbox.sqlite'), write_behind=False)
+    outbox.check_schema()
+    outbox.add('registrations', registration('ann'))
+    assert len(supabase.rows('registrations')) == 1
+    assert outbox.stats()['pending'] == 0
+
+    # When Supabase does not take it, the row waits for the flusher
+    supabase.fail(503)
+    outbox.add('registrations', registration('bob'))
+    assert outbox.stats()['pending'] == 1
@@ -0,0 +1,91 @@
+from supabase_utils import iter_rows_since
+from sync_registrations_to_drive import CursorTracker, RowDigest, DIGEST_COLUMNS, table_digest
+
+T0 = '2026-10-01T10:00:00+00:00'
+T1 = '2026-10-01T10:00:01+00:00'
+
+
+def registration(row_id, created_at=T0):
+    return {'id': row_id, 'created_at': created_at, 'telegram_id': str(row_id), 'full_name': f'User {row_id}'}
+
+
+def test_cursor_orders_integer_ids_as_numbers():
+    tracker = CursorTracker(iter([registration(9), registration(10), registration(2)]))
+    assert [row['id'] for row in tracker] == [9, 10, 2]
+    assert tracker.cursor == {'created_at': T0, 'id': 10}
+
+
+def test_cursor_follows_created_at_before_id():
+    tracker = CursorTracker(iter([registration(5, T1), registration(50, T0)]))
+    list(tracker)
+    assert tracker.cursor == {'created_at': T1, 'id': 5}
+
+
+def test_cursor_saved_with_a_string_id_still_compares_numerically():
+    tracker = CursorTracker(iter([registration(10)]), cursor={'created_at': T0, 'id': '9'})
+    list(tracker)
+    assert tracker.cursor == {'created_at': T0, 'id': 10}
+
+
+def test_cursor_keeps_uuid_ids():
+    tracker = CursorTracker(iter([registration('b1'), registration('a2')]))
+    list(tracker)
+    assert tracker.cursor == {'created_at': T0, 'id': 'b1'}
+
+
+def test_rows_without_created_at_do_not_move_the_cursor():
+    tracker = CursorTracker(iter([{'id': 99, 'created_at': None}, registration(3)]))
+    list(tracker)
+    assert tracker.cursor == {'created_at': T0, 'id': 3}
+
+
+def test_delta_sync_neither_skips_nor_repeats_rows_sharing_a_timestamp(supabase):
+    supabase.seed('registrations', [registration(i) for i in range(1, 13)])
+    tracker = CursorTracker(iter_rows_since('registrations', {'created_at': T0, 'id': 0}, page_size=5))
+    assert [row['id'] for row in tracker] == list(range(1, 13))
+
+    supabase.seed('registrations', [registration(13), registration(14, T1)])
+    delta = CursorTracker(iter_rows_since('registrations', tracker.cursor, page_size=5), tracker.cursor)
+    assert [row['id'] for row in delta] == [13, 14]
+    assert delta.cursor == {'created_at': T1, 'id': 14}
+    assert list(iter_rows_since('registrations', delta.cursor)) == []
+
+
+def digest_of(rows, table='registrations'):
+    digest = RowDigest(DIGEST_COLUMNS[table])
+    for row in rows:
+        digest.add(row)
+    return digest.value
+
+
+def test_digest_does_not_depend_on_row_order():
+    rows = [registration(i) for i in range(5)]
+    assert digest_of(rows) == digest_of(reversed(rows))
+
+
+def test_digest_extended_by_a_delta_matches_a_full_scan():
+    rows = [registration(i) for i in range(5)]
+    stored = digest_of(rows[:3])
+    digest = RowDigest(DIGEST_COLUMNS['registrations'], stored)
+    for row in rows[3:]:
+        digest.add(row)
+    assert digest.value == digest_of(rows)
+
+
+def test_digest_only_sees_its_columns():
+    rows = [registration(1), registration(2)]
+    renamed = [dict(row, full_name='Someone else') for row in rows]
+    assert digest_of(rows) == digest_of(renamed)
+    assert digest_of(rows, 'course_registrations') != digest_of(
+        [dict(row, is_paid=True) for row in rows], 'course_registrations')
+
+
+def test_digest_changes_when_a_row_is_deleted():
+    rows = [registration(i) for i in range(3)]
+    assert digest_of(rows[:2]) != digest_of(rows)
+
+
+def test_table_digest_matches_the_export_digest(supabase):
+    rows = [registration(i) for i in range(1, 8)]
+    supabase.seed('registrations', rows)
+    assert table_digest('registrations') == digest_of(rows)
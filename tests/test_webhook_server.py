@@ -0,0 +1,84 @@
+import json
+import threading
+import http.client
+
+import pytest
+
+from webhook_server import WebhookServer, register_webhook, update_chat_id, SECRET_TOKEN_HEADER
+
+TOKEN = 'test-secret_1'
+UPDATE = {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'chat': {'id': 42, 'type': 'private'}, 'text': 'hi'}}
+
+
+@pytest.fixture
+def server():
+    received = []
+    handled = threading.Event()
+
+    def process_updates(updates):
+        received.extend(updates)
+        handled.set()
+
+    server = WebhookServer(process_updates, host='127.0.0.1', port=0, path='/hook', secret_token=TOKEN, workers=2)
+    server.received, server.handled = received, handled
+    server.dispatcher.start()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    server.dispatcher.stop()
+
+
+def post(server, body, headers=None, path='/hook'):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+    data = json.dumps(body).encode('utf-8') if not isinstance(body, bytes) else body
+    connection.request('POST', path, body=data, headers={'Content-Type': 'application/json', **(headers or {})})
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+
+@pytest.mark.parametrize('secret_token', ['', 'has spaces', 'x' * 257])
+def test_server_refuses_to_start_without_a_valid_token(secret_token):
+    with pytest.raises(ValueError):
+        WebhookServer(lambda updates: None, host='127.0.0.1', port=0, secret_token=secret_token)
+
+
+def test_webhook_is_not_registered_without_a_token():
+    with pytest.raises(ValueError):
+        register_webhook(bot=None, base_url='https://bot.example.com', secret_token='')
+
+
+def test_post_without_the_token_is_rejected(server):
+    assert post(server, UPDATE) == 403
+    assert server.dispatcher.stats()['unauthorized'] == 1
+    assert server.received == []
+
+
+def test_post_with_a_wrong_token_is_rejected(server):
+    assert post(server, UPDATE, {SECRET_TOKEN_HEADER: 'guess'}) == 403
+    assert post(server, UPDATE, {SECRET_TOKEN_HEADER: ''}) == 403
+    assert server.received == []
+
+
+def test_post_with_the_token_is_dispatched(server):
+    assert post(server, UPDATE, {SECRET_TOKEN_HEADER: TOKEN}) == 200
+    assert server.handled.wait(5)
+    assert [update.update_id for update in server.received] == [1]
+    assert server.received[0].message.text == 'hi'
+
+
+def test_unknown_path_and_bad_bodies(server):
+    headers = {SECRET_TOKEN_HEADER: TOKEN}
+    assert post(server, UPDATE, headers, path='/other') == 404
+    assert post(server, b'not json', headers) == 400
+    assert post(server, {'message': {}}, headers) == 400
+    assert server.received == []
+
+
+def test_updates_are_routed_by_chat():
+    assert update_chat_id(UPDATE) == 42
+    callback = {'update_id': 2, 'callback_query': {'id': '1', 'from': {'id': 7}, 'data': 'confirm_x'}}
+    assert update_chat_id(callback) == 7
+    assert update_chat_id({'update_id': 3}) is None
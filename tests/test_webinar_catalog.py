@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+import webinar_catalog
+from webinar_catalog import WebinarCatalog
+
+WEBINARS = [{'id': 1, 'date': '2026-11-01T19:00:00', 'link': 'https://example.com/1'}]
+
+
+class CountingFetch:
+    def __init__(self, result=WEBINARS):
+        self.result = result
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return list(self.result)
+
+
+@pytest.fixture
+def fake_time(clock, monkeypatch):
+    monkeypatch.setattr(webinar_catalog, 'time', clock)
+    return clock
+
+
+def test_concurrent_readers_share_one_fetch():
+    fetch = CountingFetch()
+    fetch.release.clear()
+    catalog = WebinarCatalog(fetch=fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(catalog.all())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    fetch.started.wait(5)
+    fetch.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert fetch.calls == 1
+    assert results == [WEBINARS] * 8
+
+
+def test_snapshot_is_refetched_after_the_ttl(fake_time):
+    fetch = CountingFetch()
+    catalog = WebinarCatalog(fetch=fetch, ttl_seconds=60)
+    catalog.all()
+    fake_time.advance(59)
+    catalog.all()
+    assert fetch.calls == 1
+    fake_time.advance(2)
+    catalog.all()
+    assert fetch.calls == 2
+
+
+def test_get_and_by_id_use_string_ids():
+    catalog = WebinarCatalog(fetch=CountingFetch())
+    assert catalog.get(1) == WEBINARS[0]
+    assert catalog.get('1') == WEBINARS[0]
+    assert catalog.get(2) is None
+    assert list(catalog.by_id()) == ['1']
+
+
+def test_failed_refresh_serves_the_previous_snapshot(fake_time):
+    fetch = CountingFetch()
+    catalog = WebinarCatalog(fetch=fetch, ttl_seconds=60)
+    catalog.all()
+    fetch.result = RuntimeError('Supabase is down')
+    fake_time.advance(61)
+    assert catalog.all() == WEBINARS
+    # No new attempt until the retry pause is over
+    catalog.all()
+    assert fetch.calls == 2
+    fake_time.advance(webinar_catalog.WEBINAR_CATALOG_RETRY_SECONDS + 1)
+    catalog.all()
+    assert fetch.calls == 3
+
+
+def test_failed_first_fetch_raises():
+    catalog = WebinarCatalog(fetch=CountingFetch(RuntimeError('Supabase is down')))
+    with pytest.raises(RuntimeError):
+        catalog.all()
+
+
+def test_invalidate_during_a_fetch_forces_another_one():
+    fetch = CountingFetch()
+    catalog = WebinarCatalog(fetch=fetch)
+    catalog.all()
+    catalog.invalidate()
+    fetch.release.clear()
+    fetch.started.clear()
+    reader = threading.Thread(target=catalog.all)
+    reader.start()
+    fetch.started.wait(5)
+    # The webinars change while the refresh is still reading the old ones
+    catalog.invalidate()
+    fetch.release.set()
+    reader.join(5)
+    assert fetch.calls == 2
+    catalog.all()
+    assert fetch.calls == 3
@@ -0,0 +1,236 @@
+import os
+import re
+import hmac
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+from telebot import types
+from metrics import registry
+
+# Webhook ingestion: Telegram POSTs each update to WEBHOOK_PATH, the request is
+# checked against the secret token, queued, and answered right away; a pool of
+# workers runs the handlers. A full queue answers 503 so Telegram retries later
+# instead of the server piling up work.
+#
+# The server does not start without WEBHOOK_SECRET_TOKEN: the URL is public, and
+# without the token anyone who finds it could post forged updates (a payment
+# confirmation, say). Requests without the matching header are answered 403.
+#
+# Try it locally without Telegram (BOT_MODE=webhook, WEBHOOK_SECRET_TOKEN=test):
+#   curl -X POST -H 'Content-Type: application/json' \
+#        -H 'X-Telegram-Bot-Api-Secret-Token: test' \
+#        --data @update.json http://127.0.0.1:8443/telegram/webhook
+
+load_dotenv()
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+# PORT is what most PaaS hosts hand to web processes
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT') or os.getenv('PORT') or '8443')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+# Public base URL registered with setWebhook, e.g. https://bot.example.com (empty: register it yourself)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+# Sent back by Telegram in X-Telegram-Bot-Api-Secret-Token; requests without it are rejected.
+# Required: 1-256 characters from A-Z, a-z, 0-9, _ and - (Telegram's rules)
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+# Telegram updates are a few KB; anything far bigger is not from Telegram
+WEBHOOK_MAX_BODY_BYTES = 1024 * 1024
+# Seconds Telegram is asked to wait before retrying when the queue is full
+WEBHOOK_RETRY_AFTER = 1
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+SECRET_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,256}')
+
+
+def check_secret_token(secret_token):
+    """
+    Raise ValueError unless secret_token is one Telegram accepts; the webhook
+    is never served unauthenticated.
+    """
+    if not secret_token:
+        raise ValueError("WEBHOOK_SECRET_TOKEN is not set; refusing to serve unauthenticated webhooks")
+    if not SECRET_TOKEN_PATTERN.fullmatch(secret_token):
+        raise ValueError("WEBHOOK_SECRET_TOKEN must be 1-256 characters from A-Z, a-z, 0-9, _ and -")
+
+
+def update_chat_id(raw):
+    """
+    Chat (or user) an update belongs to, used to keep one chat's updates in order.
+    Returns None for update types without one.
+    """
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if key in raw:
+            return raw[key].get('chat', {}).get('id')
+    callback = raw.get('callback_query')
+    if callback:
+        message = callback.get('message') or {}
+        return message.get('chat', {}).get('id') or callback.get('from', {}).get('id')
+    for value in raw.values():
+        if isinstance(value, dict) and isinstance(value.get('from'), dict):
+            return value['from'].get('id')
+    return None
+
+
+class UpdateDispatcher:
+    """
+    Bounded worker pool in front of process_updates(list of telebot Updates).
+
+    Updates of one chat always go to the same worker, so they are handled in
+    the order Telegram sent them, while different chats run concurrently.
+    submit() never blocks: it returns False when that worker's queue is full.
+    """
+
+    def __init__(self, process_updates, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.process_updates = process_updates
+        self._queues = [queue.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self._stats = {'accepted': 0, 'processed': 0, 'failed': 0, 'overloaded': 0, 'unauthorized': 0, 'invalid': 0}
+
+    def count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def start(self):
+        for index, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(q,), name=f"webhook-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=10):
+        """
+        Let the workers finish what is already queued, then stop them.
+        """
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, raw):
+        chat_id = update_chat_id(raw)
+        index = hash(chat_id if chat_id is not None else raw.get('update_id')) % len(self._queues)
+        try:
+            self._queues[index].put_nowait(raw)
+        except queue.Full:
+            self.count('overloaded')
+            return False
+        self.count('accepted')
+        return True
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['depth'] = sum(q.qsize() for q in self._queues)
+        return stats
+
+    def _worker(self, q):
+        while True:
+            raw = q.get()
+            if raw is None:
+                q.task_done()
+                return
+            try:
+                self.process_updates([types.Update.de_json(raw)])
+                self.count('processed')
+            except Exception as e:
+                self.count('failed')
+                print(f"Error handling update {raw.get('update_id')}: {e}")
+            finally:
+                q.task_done()
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def _reply(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        server = self.server
+        if self.path.split('?')[0] != server.path:
+            self._reply(404)
+            return
+        token = self.headers.get(SECRET_TOKEN_HEADER) or ''
+        if not hmac.compare_digest(token.encode('utf-8'), server.secret_token.encode('utf-8')):
+            server.dispatcher.count('unauthorized')
+            self._reply(403)
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > WEBHOOK_MAX_BODY_BYTES:
+            server.dispatcher.count('invalid')
+            self._reply(413 if length else 400)
+            return
+        try:
+            raw = json.loads(self.rfile.read(length))
+        except ValueError:
+            raw = None
+        if not isinstance(raw, dict) or 'update_id' not in raw:
+            server.dispatcher.count('invalid')
+            self._reply(400)
+            return
+        if not server.dispatcher.submit(raw):
+            # Telegram redelivers the update after a non-2xx answer
+            self._reply(503, {'Retry-After': str(WEBHOOK_RETRY_AFTER)})
+            return
+        self._reply(200)
+
+    def do_GET(self):
+        # Health check for load balancers; reveals nothing about the bot
+        self._reply(200 if self.path.split('?')[0] == '/healthz' else 404)
+
+    def log_message(self, format, *args):
+        pass  # one line per update is too much; see webhook_updates_total
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, process_updates, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                 secret_token=WEBHOOK_SECRET_TOKEN, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        check_secret_token(secret_token)
+        super().__init__((host, port), _WebhookHandler)
+        self.path = path
+        self.secret_token = secret_token
+        self.dispatcher = UpdateDispatcher(process_updates, workers, queue_size)
+        registry.register_callback(
+            'webhook_updates_total', 'Webhook requests by outcome', 'counter',
+            lambda: [({'result': key}, value) for key, value in self.dispatcher.stats().items() if key != 'depth'],
+        )
+        registry.register_callback(
+            'webhook_queue_depth', 'Updates waiting for a webhook worker', 'gauge',
+            lambda: [({}, self.dispatcher.stats()['depth'])],
+        )
+
+    def serve(self):
+        """Start the workers and serve until interrupted."""
+        self.dispatcher.start()
+        host, port = self.server_address[:2]
+        print(f"Webhook listening on http://{host}:{port}{self.path}")
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            print("Stopping webhook server...")
+        finally:
+            self.server_close()
+            self.dispatcher.stop()
+
+
+def register_webhook(bot, base_url=WEBHOOK_URL, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET_TOKEN,
+                     max_connections=WEBHOOK_WORKERS):
+    """
+    Point Telegram at this server (setWebhook). Skipped when WEBHOOK_URL is empty.
+    """
+    if not base_url:
+        print("WEBHOOK_URL is not set, leaving the registered webhook unchanged")
+        return False
+    check_secret_token(secret_token)
+    url = base_url.rstrip('/') + path
+    # Telegram accepts 1-100 parallel connections
+    bot.set_webhook(url=url, secret_token=secret_token, max_connections=min(100, max(1, max_connections)))
+    print(f"Webhook registered at {url}")
+    return True
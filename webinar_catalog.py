@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from supabase_utils import get_webinar_dates
+
+load_dotenv()
+
+# Webinars change a couple of times a week, so a few minutes of staleness is fine
+WEBINAR_CATALOG_TTL_SECONDS = int(os.getenv('WEBINAR_CATALOG_TTL_SECONDS', '300'))
+# How long to keep serving the previous snapshot after a failed refresh
+WEBINAR_CATALOG_RETRY_SECONDS = 30
+
+
+class WebinarCatalog:
+    """
+    In-process, TTL-cached copy of the Supabase 'webinars' table.
+
+    All readers share one snapshot. When it expires, only one thread refetches
+    (single-flight); concurrent callers wait for that fetch instead of issuing
+    their own. If a refresh fails and an older snapshot exists, the old one is
+    served for WEBINAR_CATALOG_RETRY_SECONDS before trying again.
+    """
+
+    def __init__(self, fetch=get_webinar_dates, ttl_seconds=WEBINAR_CATALOG_TTL_SECONDS):
+        self._fetch = fetch
+        self._ttl_seconds = ttl_seconds
+        self._refresh_lock = threading.Lock()
+        # Guards _generation and _snapshot writes; held only briefly, never during a fetch
+        self._state_lock = threading.Lock()
+        # (webinars list, webinars by str(id), expires_at) - replaced atomically
+        self._snapshot = None
+        self._generation = 0
+
+    def _is_fresh(self, snapshot):
+        return snapshot is not None and time.monotonic() < snapshot[2]
+
+    def _load(self):
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            return snapshot
+        with self._refresh_lock:
+            # Another thread may have refreshed while we were waiting for the lock
+            snapshot = self._snapshot
+            if self._is_fresh(snapshot):
+                return snapshot
+            with self._state_lock:
+                generation = self._generation
+            try:
+                webinars = list(self._fetch())
+            except Exception as e:
+                if snapshot is None:
+                    raise
+                print(f"⚠️ Could not refresh webinar catalog, serving cached copy: {e}")
+                with self._state_lock:
+                    expires_at = time.monotonic() + WEBINAR_CATALOG_RETRY_SECONDS
+                    if generation != self._generation:
+                        expires_at = 0.0
+                    snapshot = self._snapshot = (snapshot[0], snapshot[1], expires_at)
+                return snapshot
+            by_id = {str(w['id']): w for w in webinars}
+            with self._state_lock:
+                expires_at = time.monotonic() + self._ttl_seconds
+                if generation != self._generation:
+                    # invalidate() was called mid-fetch; use the data but refetch next time
+                    expires_at = 0.0
+                snapshot = self._snapshot = (webinars, by_id, expires_at)
+            return snapshot
+
+    def all(self):
+        """
+        Return all webinars as a list of dicts with keys: id, date, link.
+        """
+        return list(self._load()[0])
+
+    def by_id(self):
+        """
+        Return a dict of webinars keyed by str(id).
+        """
+        return dict(self._load()[1])
+
+    def get(self, webinar_id):
+        """
+        Return the webinar with the given id, or None if it does not exist.
+        """
+        return self._load()[1].get(str(webinar_id))
+
+    def invalidate(self):
+        """
+        Drop the cached snapshot so the next read refetches from Supabase.
+        """
+        with self._state_lock:
+            self._generation += 1
+            snapshot = self._snapshot
+            if snapshot is not None:
+                # Keep the data around as a fallback in case the refetch fails
+                self._snapshot = (snapshot[0], snapshot[1], 0.0)
+
+
+# Shared catalog used by the bot handlers and the reminder scheduler
+webinar_catalog = WebinarCatalog()